@@ -0,0 +1,220 @@
+import re
+import numpy as np
+
+
+# The tokens of the movetext, only the comments, variations and moves are needed for the mainline
+TOKEN_REGEX = re.compile(r"""
+    \{(?P<comment>[^}]*)\}
+    |(?P<open>\()
+    |(?P<close>\))
+    |;[^\n]*
+    |\$\d+
+    |\d+\.+
+    |(?:1-0|0-1|1/2-1/2|\*)(?=\s|$)
+    |(?P<move>[^\s{}();$!?]+)[!?]*
+    """, re.VERBOSE)
+
+TAG_REGEX = re.compile(r'^\[([A-Za-z0-9][A-Za-z0-9_+#=:-]*)\s+"(.*)"\]\s*$')
+TAG_LINE_REGEX = re.compile(rb'^\[([A-Za-z0-9][A-Za-z0-9_+#=:-]*)\s+"(.*)"\]\s*$')
+ESCAPE_REGEX = re.compile(r'\\([\\"])')
+
+# My comment format: '[w, d, l];cp', only the WDL or only the CP are also possible
+COMMENT_REGEX = re.compile(r'\s*(?:\[\s*(-?\d+)\s*,\s*(-?\d+)\s*,\s*(-?\d+)\s*\])?\s*;?\s*([-+]?\d+(?:\.\d*)?)?\s*')
+EVAL_REGEX = re.compile(r'\[%eval\s(?:#([-+]?\d+)|([-+]?(?:\d{0,10}\.\d{1,2}|\d{1,10}\.?)))(?:,\d+)?\]')
+CLOCK_REGEX = re.compile(r'\[%clk\s(\d+):(\d+):(\d+(?:\.\d*)?)\]')
+
+
+def unescapeTag(value: str) -> str:
+    """
+    This function removes the escapes of quotes and backslashes from a tag value
+    """
+    return ESCAPE_REGEX.sub(r'\1', value) if '\\' in value else value
+
+
+def commentOpen(line: bytes, inComment: bool) -> bool:
+    """
+    This function returns if a {} comment is still open at the end of a movetext line
+    """
+    pos = 0
+    while True:
+        if inComment:
+            end = line.find(b'}', pos)
+            if end < 0:
+                return True
+            inComment = False
+            pos = end + 1
+        else:
+            start = line.find(b'{', pos)
+            # The rest of the line after ';' is a comment, braces in it don't count
+            semicolon = line.find(b';', pos)
+            if start < 0 or 0 <= semicolon < start:
+                return False
+            inComment = True
+            pos = start + 1
+
+
+def splitGames(pgn):
+    """
+    This function splits a PGN file opened in binary mode into games, with the rules of chess.pgn.read_game:
+    a game starts at the first line which isn't empty and ends with an empty line after its headers or in its movetext.
+    A tag line in the movetext outside of comments also starts a new game, in case the empty line is missing.
+    pgn
+        The PGN file
+    return
+        Yields the byte offset and the lines of every game
+    """
+    lines = None
+    offset = 0
+    inHeaders = False
+    emptyLines = 0
+    inComment = False
+    for line in pgn:
+        lineStart = offset
+        offset += len(line)
+        if lines is None:
+            if line.isspace() or line.startswith(b'%') or line.startswith(b';'):
+                continue
+            start = lineStart
+            lines = list()
+            inHeaders = line.startswith(b'[')
+            emptyLines = 0
+            inComment = False
+        elif inHeaders:
+            if line.isspace():
+                # One empty line between the headers is allowed
+                emptyLines += 1
+                if emptyLines > 1:
+                    yield (start, lines)
+                    lines = None
+                    continue
+            elif line.startswith(b'['):
+                emptyLines = 0
+            elif not (line.startswith(b'%') or line.startswith(b';')):
+                inHeaders = False
+        elif not inComment:
+            if line.isspace():
+                yield (start, lines)
+                lines = None
+                continue
+            if TAG_LINE_REGEX.match(line):
+                yield (start, lines)
+                start = lineStart
+                lines = list()
+                inHeaders = True
+                emptyLines = 0
+        if not inHeaders and not line.startswith(b'%'):
+            inComment = commentOpen(line, inComment)
+        lines.append(line)
+    if lines is not None:
+        yield (start, lines)
+
+
+def readGameTexts(pgnPath: str):
+    """
+    This function splits a PGN file into the texts of the games (see splitGames)
+    """
+    with open(pgnPath, 'rb') as pgn:
+        for _, lines in splitGames(pgn):
+            yield b''.join(lines).decode()
+
+
+def parseComment(comment: str) -> tuple:
+    """
+    This function reads my comment format ('[w, d, l];cp') with a single regular expression.
+    It is a faster version of functions.readComment(node, True, True) that works on the comment text
+    return -> tuple
+        The WDL as list and the CP, None if they are missing. (None, None) for comments in other formats
+    """
+    match = COMMENT_REGEX.fullmatch(comment)
+    if match is None:
+        return (None, None)
+    w, d, l, cp = match.groups()
+    wdl = [int(w), int(d), int(l)] if w is not None else None
+    return (wdl, int(float(cp)) if cp is not None else None)
+
+
+def parseGame(text: str, mateScore: int = 10000) -> tuple:
+    """
+    This function reads the headers and the annotations of the mainline of a game from its PGN text without building the game tree.
+    The moves aren't checked for legality.
+    text: str
+        The PGN text of one game
+    mateScore: int
+        The score of a mate in the Lichess evaluations, like chess.engine.Score.score(mate_score=mateScore)
+    return -> tuple
+        The headers as dictionary and the annotations as dictionary of NumPy arrays with one entry per move:
+        'moves': SAN, 'color': the side making the move (True for white), 'comment': if the move has a comment,
+        'cp', 'wdl' (shape (n, 3)): my comment format, 'eval': the Lichess evaluation from white's perspective, 'clock': the clock in seconds.
+        Missing values are NaN
+    """
+    headers = dict()
+    lines = text.strip().split('\n')
+    i = 0
+    while i < len(lines) and lines[i].startswith('['):
+        if match := TAG_REGEX.match(lines[i]):
+            headers[match.group(1)] = unescapeTag(match.group(2))
+        i += 1
+    movetext = '\n'.join(lines[i:])
+
+    moves = list()
+    comments = dict()
+    depth = 0
+    for token in TOKEN_REGEX.finditer(movetext):
+        if token.group('open'):
+            depth += 1
+        elif token.group('close'):
+            depth = max(0, depth - 1)
+        elif depth > 0:
+            continue
+        elif (move := token.group('move')) is not None:
+            moves.append(move)
+        elif (comment := token.group('comment')) is not None and moves:
+            # Several comments after a move are joined, like python-chess does
+            comments[len(moves) - 1] = f'{comments[len(moves) - 1]} {comment.strip()}' if len(moves) - 1 in comments else comment.strip()
+
+    n = len(moves)
+    whiteFirst = not ('FEN' in headers and headers['FEN'].split(' ')[1:2] == ['b'])
+    color = (np.arange(n) % 2 == 0) == whiteFirst
+    hasComment = np.zeros(n, dtype=bool)
+    cp = np.full(n, np.nan)
+    wdl = np.full((n, 3), np.nan)
+    evaluation = np.full(n, np.nan)
+    clock = np.full(n, np.nan)
+    for j, comment in comments.items():
+        if not comment:
+            continue
+        hasComment[j] = True
+        if '%' in comment:
+            if match := EVAL_REGEX.search(comment):
+                if match.group(1) is not None:
+                    mate = int(match.group(1))
+                    if mate == 0:
+                        # The player to move after the move is mated
+                        evaluation[j] = mateScore if color[j] else -mateScore
+                    else:
+                        evaluation[j] = mateScore - mate if mate > 0 else -mateScore - mate
+                else:
+                    evaluation[j] = round(float(match.group(2)) * 100)
+            if match := CLOCK_REGEX.search(comment):
+                clock[j] = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+            continue
+        w, c = parseComment(comment)
+        if w is not None:
+            wdl[j] = w
+        if c is not None:
+            cp[j] = c
+
+    return (headers, {'moves': np.array(moves, dtype=object), 'color': color, 'comment': hasComment, 'cp': cp, 'wdl': wdl, 'eval': evaluation, 'clock': clock})
+
+
+def readAnnotations(pgnPath: str, mateScore: int = 10000):
+    """
+    This function goes through the games of an annotated PGN file and yields the headers and annotations of every game (see parseGame).
+    It is much faster than chess.pgn.read_game, since it only scans the text
+    pgnPath: str
+        The path to the PGN file
+    mateScore: int
+        The score of a mate in the Lichess evaluations
+    """
+    for text in readGameTexts(pgnPath):
+        yield parseGame(text, mateScore)
@@ -3,6 +3,7 @@ import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import engines
 import pandas as pd
 import statistics
 import matplotlib.pyplot as plt
@@ -37,15 +38,15 @@ def findTrapMoves(board: chess.Board, engineOptions: tuple, maxDepth: int, minDe
         newBoard = board.copy()
         newBoard.push(move)
         scores = list()
-        engine = functions.configureEngine(*engineOptions)
-        for info in engine.analysis(newBoard, limit=chess.engine.Limit(depth=maxDepth)):
+        engine = engines.getEngine(*engineOptions)
+        # A new game for every move clears the hash, so the depths of the moves don't influence each other
+        for info in engine.analysis(newBoard, limit=chess.engine.Limit(depth=maxDepth), game=newBoard):
             if 'score' not in info.keys():
                 continue
             if info["depth"] < minDepth:
                 continue
             score = info["score"].relative.score(mate_score=1000)
             scores.append(score)
-        engine.quit()
         drop = (functions.expectedScore(scores[-1])-functions.expectedScore(min(scores)))
         if drop >= 10:
             trapErrors.append((str(move), drop/100))
@@ -70,10 +71,10 @@ def plotExpectedScoreChangeByDepth(posMoves: list, engineOptions: tuple, maxDept
     for i, (pos, move) in enumerate(posMoves):
         board = chess.Board(pos)
         board.push(chess.Move.from_uci(move))
-        engine = functions.configureEngine(*engineOptions)
+        engine = engines.getEngine(*engineOptions)
         evaluations = list()
         
-        for info in engine.analysis(board, limit=chess.engine.Limit(depth=maxDepth)):
+        for info in engine.analysis(board, limit=chess.engine.Limit(depth=maxDepth), game=board):
             if 'score' not in info.keys():
                 continue
             if info["depth"] < minDepth:
@@ -82,7 +83,6 @@ def plotExpectedScoreChangeByDepth(posMoves: list, engineOptions: tuple, maxDept
             evaluations.append(score)
 
         plt.plot(range(minDepth, maxDepth+1), [functions.expectedScore(score)/100 for score in evaluations], color=colors[i], label=chess.Board(pos).san(chess.Move.from_uci(move)))
-        engine.quit()
         
     plt.legend()
     ax.set_xlim(minDepth, maxDepth)
@@ -2,20 +2,9 @@ import chess
 from chess import engine, pgn
 from datetime import date
 import configparser
-
-
-"""
-    This function sets the UCI options for an engine
-    engineName: The name of the engine, with which it can be called from the command line
-    uci_options: Dictionary with the UCI options of the engine
-    return: chess.engine.SimpleEngine with the UCI options set
-"""
-def configureEngine(engineName, uci_options):
-    engine = chess.engine.SimpleEngine.popen_uci(engineName)
-    for k, v in uci_options.items():
-        engine.configure({k:v})
-
-    return engine
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engines import configureEngine
 
 
 """
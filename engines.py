@@ -0,0 +1,202 @@
+import atexit
+import logging
+import os
+import threading
+import chess
+from chess import engine, Board
+
+
+# The engine profiles, the name maps to the command and the UCI options of the engine
+PROFILES = {
+        'stockfish': ('stockfish', {'Threads': '10', 'Hash': '8192'}),
+        'lc0': ('lc0', {'WeightsFile': '/home/julian/Desktop/largeNet', 'UCI_ShowWDL': 'true'}),
+        'maia': ('lc0', {'UCI_ShowWDL': 'true'})
+        }
+
+# The running engines of this process, the key is the command and the options
+_engines = dict()
+_enginesPID = None
+
+
+def configureEngine(engineName: str, uci_options: dict) -> engine:
+    """
+    This method configures a chess engine with the given UCI options and returns the
+    engine.
+    engineName: str
+        The name of the engine (or the command to start the engine)
+    uci_optins: dict
+        A dictionary containing the UCI options used for the engine
+    return -> engine
+        A configuered chess.engine
+    """
+    eng = engine.SimpleEngine.popen_uci(engineName)
+    # All options are sent at once, so the engine only allocates the hash and threads once
+    eng.configure(uci_options)
+
+    return eng
+
+
+def startDaemonEngine(command: str, options: dict) -> engine:
+    """
+    This function starts an engine like configureEngine, but its event loop runs in a daemon thread.
+    The interpreter waits for normal threads before it runs the atexit handlers, so closeEngines couldn't quit the engines otherwise.
+    A thread inherits the daemon flag of the thread starting it, so the engine is started from a daemon thread.
+    """
+    result = dict()
+
+    def start():
+        try:
+            result['engine'] = configureEngine(command, options)
+        except Exception as e:
+            result['error'] = e
+
+    starter = threading.Thread(target=start, daemon=True)
+    starter.start()
+    starter.join()
+    if 'error' in result:
+        raise result['error']
+    return result['engine']
+
+
+class RestartingEngine:
+    """
+    This class wraps an engine and starts it again with the same options if the engine process died during an analysis.
+    It can be used in place of the engine in the analysis functions.
+    """
+    def __init__(self, command: str, options: dict, retries: int = 3):
+        """
+        command: str
+            The command to start the engine
+        options: dict
+            The UCI options of the engine
+        retries: int
+            How often a position is tried again with a new engine
+        """
+        self.command = command
+        self.options = dict(options)
+        self.retries = retries
+        self.engine = startDaemonEngine(command, options)
+
+
+    def __getattr__(self, name: str):
+        if name == 'engine':
+            raise AttributeError(name)
+        # Everything else (play, id, ...) goes directly to the engine
+        return getattr(self.engine, name)
+
+
+    def restart(self):
+        logging.warning(f'{self.command} terminated, restarting it')
+        try:
+            self.engine.quit()
+        except (chess.engine.EngineTerminatedError, chess.engine.EngineError, TimeoutError):
+            pass
+        self.engine = startDaemonEngine(self.command, self.options)
+
+
+    def analyse(self, board: Board, limit: chess.engine.Limit, **kwargs):
+        for _ in range(self.retries):
+            try:
+                return self.engine.analyse(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                self.restart()
+        return self.engine.analyse(board, limit, **kwargs)
+
+
+    def analysis(self, board: Board, limit: chess.engine.Limit = None, **kwargs):
+        """
+        This function starts an analysis which yields the infos during the search, like SimpleEngine.analysis.
+        A dead engine is restarted before the analysis starts. If the engine dies during the analysis,
+        the iteration raises EngineTerminatedError and the analysis has to be started again.
+        """
+        for _ in range(self.retries):
+            try:
+                return self.engine.analysis(board, limit, **kwargs)
+            except chess.engine.EngineTerminatedError:
+                self.restart()
+        return self.engine.analysis(board, limit, **kwargs)
+
+
+    def configure(self, options: dict):
+        self.options.update(options)
+        self.engine.configure(options)
+
+
+    def quit(self):
+        self.engine.quit()
+
+
+def getEngine(name: str = 'stockfish', options: dict = None) -> RestartingEngine:
+    """
+    This function returns a running engine of this process. The engine is started on the first call and reused afterwards.
+    The engines are closed when the program exits, so they shouldn't be quit by the caller. Use releaseEngine to close one earlier.
+    name: str
+        The name of a profile in PROFILES or the command to start the engine
+    options: dict
+        The UCI options. For a profile, they are added to the options of the profile
+    return -> RestartingEngine
+        The configured engine
+    """
+    global _engines, _enginesPID
+    if _enginesPID != os.getpid():
+        # A forked process can't use the engines of its parent
+        _engines = dict()
+        _enginesPID = os.getpid()
+
+    command, options = resolveProfile(name, options)
+    key = engineKey(command, options)
+    if key not in _engines:
+        _engines[key] = RestartingEngine(command, options)
+    return _engines[key]
+
+
+def resolveProfile(name: str, options: dict = None) -> tuple:
+    """
+    This function returns the command and the UCI options of a profile in PROFILES or of a command
+    """
+    if name in PROFILES:
+        command, profileOptions = PROFILES[name]
+        return (command, {**profileOptions, **(options or {})})
+    return (name, options or {})
+
+
+def engineKey(command: str, options: dict) -> tuple:
+    return (command, tuple(sorted((k, str(v)) for k, v in options.items())))
+
+
+def releaseEngine(name: str = 'stockfish', options: dict = None):
+    """
+    This function quits an engine started by getEngine, i.e. an engine which is only needed for a short time.
+    The next getEngine call with the same name and options starts a new engine.
+    name: str
+        The name of a profile in PROFILES or the command to start the engine
+    options: dict
+        The UCI options given to getEngine
+    """
+    if _enginesPID != os.getpid():
+        return
+    eng = _engines.pop(engineKey(*resolveProfile(name, options)), None)
+    if eng is None:
+        return
+    try:
+        eng.quit()
+    except (chess.engine.EngineTerminatedError, chess.engine.EngineError, TimeoutError):
+        pass
+
+
+def closeEngines():
+    """
+    This function quits all engines started by getEngine in this process
+    """
+    global _engines
+    if _enginesPID != os.getpid():
+        return
+    for eng in _engines.values():
+        try:
+            eng.quit()
+        except (chess.engine.EngineTerminatedError, chess.engine.EngineError, TimeoutError):
+            pass
+    _engines = dict()
+
+
+atexit.register(closeEngines)
@@ -1,8 +1,45 @@
 import sqlite3
+import os
+import atexit
 import functions
 import chess
+import chess.polyglot
 import json
-import pandas as pd
+import numpy as np
+import hashlib
+import itertools
+import threading
+import queue
+import argparse
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from collections import OrderedDict
+import time
+try:
+    import orjson as jsonParser
+except ImportError:
+    jsonParser = json
+
+DB_PATH = '../out/evaluation.db'
+WRITER_ADDRESS = ('localhost', 6001)
+# The environment variable with the shared key of the writer and its clients, if --authkey isn't given
+WRITER_AUTHKEY_VARIABLE = 'EVALDB_WRITER_AUTHKEY'
+# The EvalStore functions a client may call through the writer
+WRITER_OPS = ('insert', 'update', 'addEval')
+
+EVAL_COLUMNS = 'position, nodes, w, d, l, depth, cp, mate, pv'
+# Rough memory use of one cached evaluation (FEN string, dictionary and WDL list)
+CACHE_ENTRY_BYTES = 600
+
+# Fixed-width record of the read-only snapshot, missing values are stored as the smallest integer of the type
+SNAPSHOT_DTYPE = np.dtype([('hash', '<i8'), ('cp', '<i4'), ('depth', '<i2'), ('w', '<i2'), ('d', '<i2'), ('l', '<i2'), ('nodes', '<i8')])
+
+# Promotion piece of a packed move, 0 means no promotion
+PROMOTION_CODES = {'n': 1, 'b': 2, 'r': 3, 'q': 4}
+
+_store = None
+_storePID = None
+
 
 def createTable(name: str):
     """
@@ -26,40 +63,891 @@ def createTable(name: str):
             )""")
 
 
-def insert(position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None):
+def createZobristTable(name: str):
+    """
+    This function creates the evaluation table keyed by the 64-bit Zobrist (polyglot) hash of the position.
+    The hash is the rowid of the table, so there is no second index on the FEN.
+    The FEN is still stored to detect hash collisions.
+    name: str
+        The filename of the database
+    """
+    con = sqlite3.connect(name)
+    cur = con.cursor()
+    cur.execute("""CREATE TABLE eval(
+            hash INTEGER PRIMARY KEY,
+            position TEXT,
+            nodes INT,
+            w INT,
+            d INT,
+            l INT,
+            depth INT,
+            cp INT,
+            mate INT,
+            pv TEXT
+            )""")
+    con.commit()
+    con.close()
+
+
+def zobristKey(position: str) -> tuple:
+    """
+    This function returns the polyglot Zobrist hash of a position and its FEN without move counters.
+    The hash is returned as signed 64-bit integer, since SQLite integers are signed.
+    position: str
+        The FEN of the position, with or without the move counters
+    return -> tuple
+        The hash and the FEN used to detect collisions
+    """
+    board = chess.Board(position)
+    return (boardKey(board), board.epd())
+
+
+def boardKey(board: chess.Board) -> int:
+    """
+    This function returns the polyglot Zobrist hash of a board as signed 64-bit integer.
+    Callers which already have the board pass it to the lookups, which is much cheaper than parsing the FEN again (see zobristKey)
+    """
+    key = chess.polyglot.zobrist_hash(board)
+    if key >= 2**63:
+        key -= 2**64
+    return key
+
+
+def encodePV(pv, maxLength: int = None) -> bytes:
+    """
+    This function packs a principal variation into 16 bits per move (from square, to square and promotion piece).
+    pv:
+        The PV as list of chess.Move or as string of UCI moves separated by spaces (like in the Lichess dump)
+    maxLength: int
+        If this is set, only the first moves of the PV are stored
+    return -> bytes
+        The packed PV or None if there is no PV
+    """
+    if pv is None or isinstance(pv, bytes):
+        return pv
+    if isinstance(pv, str):
+        if pv == 'None':
+            return None
+        moves = pv.split()
+    else:
+        moves = [move.uci() for move in pv]
+    if maxLength is not None:
+        moves = moves[:maxLength]
+    codes = list()
+    for m in moves:
+        fromSquare = ord(m[0]) - 97 + 8 * (ord(m[1]) - 49)
+        toSquare = ord(m[2]) - 97 + 8 * (ord(m[3]) - 49)
+        promotion = PROMOTION_CODES[m[4]] if len(m) > 4 else 0
+        codes.append(fromSquare | toSquare << 6 | promotion << 12)
+    return np.array(codes, dtype='<u2').tobytes()
+
+
+def decodePV(pv) -> list:
+    """
+    This function unpacks a PV stored by encodePV. PVs stored as text by older versions are also read.
+    return -> list
+        The PV as list of chess.Move
+    """
+    if pv is None or pv == 'None':
+        return []
+    if isinstance(pv, str):
+        return [chess.Move.from_uci(m) for m in pv.split()]
+    moves = list()
+    for code in np.frombuffer(pv, dtype='<u2').tolist():
+        promotion = code >> 12
+        moves.append(chess.Move(code & 63, code >> 6 & 63, promotion + 1 if promotion else None))
+    return moves
+
+
+class LRUCache:
+    """
+    This class is a bounded in-memory cache of evaluations, which evicts the least recently used position.
+    It counts hits, misses and evictions, so the cache effectiveness of a run can be checked.
+    """
+    def __init__(self, maxEntries: int = 100000, maxMB: float = None):
+        """
+        maxEntries: int
+            The maximal number of cached positions
+        maxMB: float
+            If this is set, the size is given in (approximate) megabytes instead of entries
+        """
+        if maxMB is not None:
+            maxEntries = int(maxMB * 2**20 / CACHE_ENTRY_BYTES)
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, position: str) -> dict:
+        """
+        This function returns a copy of the cached evaluation or None and counts the lookup as hit or miss
+        """
+        entry = self.entries.get(position)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(position)
+        return dict(entry, wdl=list(entry['wdl']))
+
+
+    def put(self, position: str, evaluation: dict):
+        if self.maxEntries <= 0:
+            return
+        self.entries[position] = evaluation
+        self.entries.move_to_end(position)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.entries), 'hitRate': self.hits/lookups if lookups else 0}
+
+
+class BloomFilter:
+    """
+    This class is a Bloom filter of the positions in the database.
+    If a position is not in the filter, it is definitely not in the database, so the lookup can be skipped.
+    """
+    def __init__(self, capacity: int, falsePositiveRate: float = 0.01):
+        """
+        capacity: int
+            The number of positions the filter is sized for
+        falsePositiveRate: float
+            The probability that a position which isn't in the database passes the filter (at full capacity)
+        """
+        self.nBits = max(8, int(-capacity * np.log(falsePositiveRate) / np.log(2)**2))
+        self.nHashes = max(1, round(self.nBits / capacity * np.log(2)))
+        self.bits = np.zeros((self.nBits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        # The number of rows of the table the filter was made for, a saved filter with another number is outdated
+        self.rows = -1
+
+
+    def indices(self, positions: list) -> np.ndarray:
+        """
+        This function returns the bit indices of the positions (one row per position) using double hashing
+        """
+        digests = [hashlib.blake2b(p.encode(), digest_size=16).digest() for p in positions]
+        h = np.frombuffer(b''.join(digests), dtype=np.uint64).reshape(-1, 2)
+        i = np.arange(self.nHashes, dtype=np.uint64)
+        return (h[:, :1] + i * h[:, 1:]) % np.uint64(self.nBits)
+
+
+    def addMany(self, positions: list):
+        if not positions:
+            return
+        idx = self.indices(positions).ravel()
+        np.bitwise_or.at(self.bits, idx >> np.uint64(3), (np.uint8(1) << (idx & np.uint64(7)).astype(np.uint8)))
+        self.count += len(positions)
+
+
+    def add(self, position: str):
+        self.addMany([position])
+
+
+    def __contains__(self, position: str) -> bool:
+        idx = self.indices([position])[0]
+        return bool(np.all(self.bits[idx >> np.uint64(3)] & (np.uint8(1) << (idx & np.uint64(7)).astype(np.uint8))))
+
+
+    def save(self, path: str):
+        tmpPath = f'{path}.tmp'
+        with open(tmpPath, 'wb') as f:
+            np.savez(f, bits=self.bits, params=np.array([self.nBits, self.nHashes, self.count, self.rows], dtype=np.int64))
+        os.replace(tmpPath, path)
+
+
+    @classmethod
+    def load(cls, path: str):
+        data = np.load(path)
+        bloom = cls.__new__(cls)
+        bloom.bits = data['bits']
+        params = [int(x) for x in data['params']]
+        bloom.nBits, bloom.nHashes, bloom.count = params[:3]
+        # Filters saved without the number of rows are always outdated
+        bloom.rows = params[3] if len(params) > 3 else -1
+        return bloom
+
+
+def bloomPath(name: str) -> str:
+    """
+    This function returns the path of the Bloom filter saved next to a database
+    """
+    return f'{name}.bloom'
+
+
+class EvalStore:
+    """
+    This class holds one long-lived connection to the evaluation database.
+    All statements are parameterised, so sqlite3 can reuse the prepared statements from its cache.
+    The database is switched to WAL journaling, which allows readers while another process writes.
+    Both the FEN keyed table from createTable and the hash keyed table from createZobristTable are supported,
+    the positions are always passed as FEN strings.
+    Evaluations which were read or written are kept in an LRU cache, so repeated positions don't touch the database.
+    """
+    def __init__(self, name: str = DB_PATH, timeout: float = 30, cacheEntries: int = 100000, cacheMB: float = None, pvLength: int = None):
+        """
+        name: str
+            The filename of the database
+        timeout: float
+            Seconds to wait for a lock held by another connection
+        cacheEntries: int
+            The size of the in-memory cache in positions, 0 disables the cache
+        cacheMB: float
+            The size of the in-memory cache in megabytes, this replaces cacheEntries
+        pvLength: int
+            The maximal number of moves of a stored PV, by default the whole PV is stored
+        """
+        self.name = name
+        self.pvLength = pvLength
+        self.cache = LRUCache(cacheEntries, cacheMB)
+        # If this is set, inserts and updates are sent to a BatchWriter or WriterClient instead of being written here
+        self.writer = None
+        # If this is set, positions which are not in the Bloom filter are treated as missing without a query
+        self.bloom = None
+        # If positions were added to the filter since it was loaded or built, it is saved again by close()
+        self.bloomChanged = False
+        self.con = sqlite3.connect(name, timeout=timeout)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.cur = self.con.cursor()
+
+        self.zobrist = 'hash' in [c[1] for c in self.cur.execute('PRAGMA table_info(eval)')]
+        self.key = 'hash' if self.zobrist else 'position'
+        columns = f'hash, {EVAL_COLUMNS}' if self.zobrist else EVAL_COLUMNS
+        placeholders = ', '.join(['?'] * len(columns.split(',')))
+        self.insertSQL = f'INSERT INTO eval ({columns}) VALUES ({placeholders})'
+        self.insertIgnoreSQL = f'INSERT OR IGNORE INTO eval ({columns}) VALUES ({placeholders})'
+        self.selectSQL = f'SELECT w,d,l,nodes,cp,depth,position FROM eval WHERE {self.key}=?'
+
+        # Table with all evaluations of a position, the key is the same as in the eval table
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS evals(
+                key NOT NULL,
+                position TEXT,
+                engine TEXT NOT NULL,
+                network TEXT NOT NULL,
+                depth INT NOT NULL,
+                nodes INT NOT NULL,
+                cp INT,
+                mate INT,
+                w INT,
+                d INT,
+                l INT,
+                pv TEXT,
+                PRIMARY KEY (key, engine, network, depth, nodes)
+                )""")
+        self.con.commit()
+
+
+    def keyOf(self, position: str, key: int = None) -> tuple:
+        """
+        This function returns the key of a position in the table and the FEN stored with it.
+        key: int
+            The hash of the position from boardKey. If it is given, position has to be the FEN without move counters
+            of the same board (functions.modifyFEN), so the FEN doesn't have to be parsed. It is ignored by the FEN keyed table
+        """
+        if not self.zobrist:
+            return (position, position)
+        if key is not None:
+            return (key, position)
+        return zobristKey(position)
+
+
+    def boardKey(self, board: chess.Board) -> int:
+        """
+        This function returns the key to pass to the lookups for a board, None for the FEN keyed table which doesn't need it
+        """
+        return boardKey(board) if self.zobrist else None
+
+
+    def rowValues(self, row: tuple, key: int = None) -> tuple:
+        """
+        This function adds the hash to a row starting with the position, if the table is keyed by the hash.
+        The PV at the end of the row is packed with encodePV.
+        """
+        row = tuple(row[:-1]) + (encodePV(row[-1], self.pvLength),)
+        if self.zobrist:
+            return self.keyOf(row[0], key) + row[1:]
+        return row
+
+
+    def lookupKeys(self, positions: list, keys: list = None) -> dict:
+        """
+        This function maps the table keys of the positions to the stored FEN and the position as given
+        keys: list
+            The hashes of the positions from boardKey, in the same order
+        """
+        tableKeys = dict()
+        for position, key in zip(positions, keys or [None] * len(positions)):
+            key, fen = self.keyOf(position, key)
+            if self.bloom is not None and fen not in self.bloom:
+                continue
+            tableKeys[key] = (fen, position)
+        return tableKeys
+
+
+    def useBloomFilter(self, falsePositiveRate: float = 0.01, rebuild: bool = False):
+        """
+        This function loads the Bloom filter saved next to the database or builds it if there is none.
+        A saved filter is only used if the table still has the number of rows the filter was saved with,
+        otherwise positions inserted after it was saved would be treated as missing.
+        The filter is a snapshot: positions inserted by other processes afterwards are only found after a rebuild.
+        falsePositiveRate: float
+            The false positive rate of a newly built filter
+        rebuild: bool
+            If this is true, the filter is always built from the database
+        """
+        path = bloomPath(self.name)
+        if os.path.exists(path) and not rebuild:
+            self.bloom = BloomFilter.load(path)
+            if self.bloom.rows == self.countRows():
+                self.bloomChanged = False
+                return self.bloom
+        self.bloom = self.buildBloomFilter(falsePositiveRate)
+        self.bloom.save(path)
+        self.bloomChanged = False
+        return self.bloom
+
+
+    def saveBloomFilter(self):
+        """
+        This function saves the Bloom filter with the positions added since it was loaded, so the next run doesn't have to build it
+        """
+        self.bloom.rows = self.countRows()
+        self.bloom.save(bloomPath(self.name))
+        self.bloomChanged = False
+
+
+    def countRows(self) -> int:
+        return self.cur.execute('SELECT COUNT(*) FROM eval').fetchone()[0]
+
+
+    def buildBloomFilter(self, falsePositiveRate: float = 0.01, chunkSize: int = 100000) -> BloomFilter:
+        """
+        This function builds a Bloom filter of all positions in the database.
+        It is sized for twice the current number of positions, so later imports still fit.
+        """
+        nPositions = self.countRows()
+        bloom = BloomFilter(max(2 * nPositions, 100000), falsePositiveRate)
+        rows = self.con.execute('SELECT position FROM eval')
+        while chunk := rows.fetchmany(chunkSize):
+            bloom.addMany([row[0] for row in chunk])
+        bloom.rows = nPositions
+        return bloom
+
+
+    def insert(self, position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None, commit: bool = True, key: int = None):
+        if self.writer:
+            self.writer.put(('insert', (position, nodes, w, d, l, depth, cp, mate, pv)))
+        else:
+            try:
+                self.cur.execute(self.insertSQL, self.rowValues((position, nodes, w, d, l, depth, cp, mate, pv), key))
+            except sqlite3.IntegrityError:
+                # The position is already stored, i.e. it was missing in an outdated Bloom filter
+                self.update(position, nodes, w, d, l, depth, cp, mate, pv, commit=False, key=key)
+            if commit:
+                self.con.commit()
+        if self.bloom is not None:
+            self.bloom.add(self.keyOf(position, key)[1])
+            self.bloomChanged = True
+        self.cache.put(position, {'cp': cp, 'depth': depth, 'wdl': [w, d, l], 'nodes': nodes})
+
+
+    def insertMany(self, rows: list, ignore: bool = True, commit: bool = True):
+        """
+        This function inserts many (position, nodes, w, d, l, depth, cp, mate, pv) rows in one transaction
+        ignore: bool
+            If this is true, rows of positions which are already in the database are skipped
+        """
+        sql = self.insertIgnoreSQL if ignore else self.insertSQL
+        values = [self.rowValues(row) for row in rows]
+        self.cur.executemany(sql, values)
+        if commit:
+            self.con.commit()
+        if self.bloom is not None:
+            self.bloom.addMany([v[1] if self.zobrist else v[0] for v in values])
+            self.bloomChanged = True
+
+
+    def update(self, position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None, commit: bool = True, key: int = None):
+        """
+        This function updates the LC0 part (nodes and WDL) and/or the Stockfish part (depth, CP, mate and PV) of a position.
+        A part is only changed if it is given, so updating the WDL keeps the CP and vice versa.
+        The PV is only changed if a new one is given.
+        """
+        values = dict()
+        if nodes != -1 or w is not None:
+            values.update({'nodes': nodes, 'w': w, 'd': d, 'l': l})
+        if depth != -1 or cp is not None:
+            values.update({'depth': depth, 'cp': cp, 'mate': mate})
+            if pv is not None:
+                values['pv'] = encodePV(pv, self.pvLength)
+        if not values:
+            return
+
+        if self.writer:
+            self.writer.put(('update', (position, nodes, w, d, l, depth, cp, mate, pv)))
+        else:
+            columns = ', '.join([f'{c}=?' for c in values.keys()])
+            self.cur.execute(f'UPDATE eval SET {columns} WHERE {self.key}=? AND position=?', tuple(values.values()) + self.keyOf(position, key))
+            if commit:
+                self.con.commit()
+        if (entry := self.cache.entries.get(position)) is not None:
+            if 'nodes' in values:
+                entry['nodes'] = nodes
+                entry['wdl'] = [w, d, l]
+            if 'depth' in values:
+                entry['depth'] = depth
+                entry['cp'] = cp
+                entry['mate'] = mate
+            if 'pv' in values:
+                entry['pv'] = decodePV(values['pv'])
+
+
+    def addEval(self, position: str, engine: str, network: str = '', depth: int = 0, nodes: int = 0, cp: int = None, mate: int = None, w: int = None, d: int = None, l: int = None, pv: str = None, commit: bool = True, key: int = None):
+        """
+        This function stores an evaluation in the table of all evaluations.
+        Evaluations with a different engine, network, depth or node count are kept next to each other,
+        an evaluation with the same ones is replaced.
+        engine: str
+            The name of the engine
+        network: str
+            The network (weights file) of the engine, if it uses one
+        depth: int
+            The depth reached
+        nodes: int
+            The number of nodes searched
+        """
+        if self.writer:
+            self.writer.put(('addEval', (position, engine, network, depth, nodes, cp, mate, w, d, l, pv)))
+            return
+        key, fen = self.keyOf(position, key)
+        self.cur.execute('INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (key, fen, engine, network or '', depth or 0, nodes or 0, cp, mate, w, d, l, encodePV(pv, self.pvLength)))
+        if commit:
+            self.con.commit()
+
+
+    def getBestEval(self, position: str, minDepth: int = 0, minNodes: int = 0, wdl: bool = False, engine: str = None, network: str = None, key: int = None) -> dict:
+        """
+        This function returns the strongest stored evaluation of a position which satisfies the given limits.
+        minDepth: int
+            The minimal depth of the evaluation
+        minNodes: int
+            The minimal number of nodes of the evaluation
+        wdl: bool
+            If this is true, the evaluation has to have a WDL (LC0) and the one with the most nodes is returned,
+            otherwise it has to have a CP or mate score and the deepest one is returned
+        engine: str
+            If this is set, only evaluations by this engine are used
+        network: str
+            If this is set, only evaluations with this network are used
+        return -> dict
+            The evaluation in the same format as getEval with the mate score, engine, network and PV added, or None
+        """
+        key, fen = self.keyOf(position, key)
+        query = 'SELECT w,d,l,nodes,cp,depth,mate,engine,network,pv FROM evals WHERE key=? AND position=? AND depth>=? AND nodes>=?'
+        params = [key, fen, minDepth, minNodes]
+        if engine is not None:
+            query += ' AND engine=?'
+            params.append(engine)
+        if network is not None:
+            query += ' AND network=?'
+            params.append(network)
+        if wdl:
+            query += ' AND w IS NOT NULL ORDER BY nodes DESC, depth DESC LIMIT 1'
+        else:
+            query += ' AND (cp IS NOT NULL OR mate IS NOT NULL) ORDER BY depth DESC, nodes DESC LIMIT 1'
+        row = self.cur.execute(query, params).fetchone()
+        if row is None:
+            return None
+        evaluation = rowToEval(row)
+        evaluation.update({'mate': row[6], 'engine': row[7], 'network': row[8], 'pv': decodePV(row[9])})
+        return evaluation
+
+
+    def getEval(self, position: str, key: int = None) -> dict:
+        """
+        This function returns the stored evaluation of a position or None if the position is not in the database.
+        key is the hash from boardKey, see keyOf
+        """
+        if (evaluation := self.cache.get(position)) is not None:
+            return evaluation
+        key, fen = self.keyOf(position, key)
+        if self.bloom is not None and fen not in self.bloom:
+            return None
+        row = self.cur.execute(self.selectSQL, (key,)).fetchone()
+        # A different position means a hash collision
+        if row is None or row[6] != fen:
+            return None
+        evaluation = rowToEval(row)
+        self.cache.put(position, evaluation)
+        return dict(evaluation, wdl=list(evaluation['wdl']))
+
+
+    def getPV(self, position: str, key: int = None) -> list:
+        """
+        This function returns the stored PV of a position as list of chess.Move
+        """
+        key, fen = self.keyOf(position, key)
+        row = self.cur.execute(f'SELECT pv, position FROM eval WHERE {self.key}=?', (key,)).fetchone()
+        if row is None or row[1] != fen:
+            return []
+        return decodePV(row[0])
+
+
+    def getEvals(self, positions: list, chunkSize: int = 500, keys: list = None) -> dict:
+        """
+        This function looks up many positions at once, for example all plies of a game.
+        positions: list
+            The positions (modified FENs) to look up
+        chunkSize: int
+            The number of positions per query, since SQLite limits the number of parameters
+        keys: list
+            The hashes of the positions from boardKey, in the same order (see keyOf)
+        return -> dict
+            The positions found in the database as keys and their evaluations as values
+        """
+        evals = dict()
+        missing = dict()
+        for position, key in zip(positions, keys or [None] * len(positions)):
+            if position in evals or position in missing:
+                continue
+            if (evaluation := self.cache.get(position)) is not None:
+                evals[position] = evaluation
+            else:
+                missing[position] = key
+
+        keys = list(self.lookupKeys(list(missing.keys()), list(missing.values())).items())
+        for i in range(0, len(keys), chunkSize):
+            chunk = dict(keys[i:i+chunkSize])
+            query = f'SELECT {self.key},w,d,l,nodes,cp,depth,position FROM eval WHERE {self.key} IN ({",".join("?"*len(chunk))})'
+            for row in self.cur.execute(query, list(chunk.keys())):
+                fen, position = chunk[row[0]]
+                if row[7] == fen:
+                    evaluation = rowToEval(row[1:])
+                    self.cache.put(position, evaluation)
+                    evals[position] = dict(evaluation, wdl=list(evaluation['wdl']))
+        return evals
+
+
+    def contains(self, position: str, key: int = None) -> bool:
+        if position in self.cache.entries:
+            return True
+        key, fen = self.keyOf(position, key)
+        if self.bloom is not None and fen not in self.bloom:
+            return False
+        row = self.cur.execute(f'SELECT position FROM eval WHERE {self.key}=?', (key,)).fetchone()
+        return row is not None and row[0] == fen
+
+
+    def containsMany(self, positions: list, chunkSize: int = 500, keys: list = None) -> set:
+        """
+        This function returns the set of the given positions which are in the database
+        """
+        keys = list(self.lookupKeys(positions, keys).items())
+        found = set()
+        for i in range(0, len(keys), chunkSize):
+            chunk = dict(keys[i:i+chunkSize])
+            query = f'SELECT {self.key},position FROM eval WHERE {self.key} IN ({",".join("?"*len(chunk))})'
+            for row in self.cur.execute(query, list(chunk.keys())):
+                fen, position = chunk[row[0]]
+                if row[1] == fen:
+                    found.add(position)
+        return found
+
+
+    def commit(self):
+        self.con.commit()
+
+
+    def close(self):
+        self.con.commit()
+        if self.bloom is not None and self.bloomChanged and self.writer is None:
+            self.saveBloomFilter()
+        self.con.close()
+
+
+def rowToEval(row: tuple) -> dict:
+    """
+    This function turns a (w, d, l, nodes, cp, depth) row into the evaluation dictionary returned by getEval
+    """
+    return {'cp': row[4], 'depth': row[5], 'wdl': [row[0], row[1], row[2]], 'nodes': row[3]}
+
+
+class BatchWriter(threading.Thread):
+    """
+    This thread is the single writer of an evaluation database.
+    Inserts and updates are put into a queue and written in one transaction per batch,
+    so many analysis workers can share the database without locking each other out.
+    """
+    def __init__(self, name: str = DB_PATH, batchSize: int = 500, interval: float = 1):
+        """
+        name: str
+            The filename of the database
+        batchSize: int
+            The maximal number of writes per transaction
+        interval: float
+            The maximal time in seconds a write waits in the queue
+        """
+        super().__init__(daemon=True)
+        self.dbName = name
+        self.batchSize = batchSize
+        self.interval = interval
+        self.queue = queue.Queue()
+        # Threads forwarding the writes of connected clients
+        self.clients = list()
+
+
+    def put(self, item: tuple):
+        """
+        This function queues a write. The item is the name of the EvalStore function (insert, update or addEval) and its arguments
+        """
+        self.queue.put(item)
+
+
+    def run(self):
+        # The connection has to be created in the writer thread
+        store = EvalStore(self.dbName, cacheEntries=0)
+        running = True
+        while running:
+            try:
+                item = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            batch = list()
+            deadline = time.time() + self.interval
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batchSize:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0, deadline-time.time()))
+                except queue.Empty:
+                    break
+            # None is put into the queue by close()
+            running = item is not None
+
+            for op, values in batch:
+                if op == 'insert':
+                    # Another worker might have inserted the position already
+                    store.insertMany([values], ignore=True, commit=False)
+                else:
+                    getattr(store, op)(*values, commit=False)
+            store.commit()
+        store.close()
+
+
+    def close(self, clientTimeout: float = 10):
+        """
+        This function waits until the clients disconnected, writes the remaining queue and stops the thread
+        """
+        for client in self.clients:
+            client.join(clientTimeout)
+        self.queue.put(None)
+        self.join()
+
+
+def writerKey() -> bytes:
+    """
+    This function returns the shared key of the writer from the environment variable WRITER_AUTHKEY_VARIABLE
+    """
+    authkey = os.environ.get(WRITER_AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError(f'The writer needs a shared key, set {WRITER_AUTHKEY_VARIABLE}')
+    return authkey.encode()
+
+
+def pvText(pv) -> str:
+    """
+    This function turns a PV given to insert, update or addEval into UCI moves separated by spaces, so it can be sent as JSON
+    """
+    if pv is None or isinstance(pv, str):
+        return pv
+    if isinstance(pv, bytes):
+        pv = decodePV(pv)
+    return ' '.join(move.uci() for move in pv)
+
+
+class WriterClient:
+    """
+    This class sends the writes of an analysis process to the writer started with serveWriter
+    """
+    def __init__(self, address: tuple = WRITER_ADDRESS, authkey: bytes = None):
+        """
+        authkey: bytes
+            The shared key of the writer, the default is the environment variable WRITER_AUTHKEY_VARIABLE
+        """
+        self.conn = Client(address, authkey=authkey or writerKey())
+
+
+    def put(self, item: tuple):
+        # Connection.send would pickle the write and the writer would have to unpickle whatever it receives
+        op, values = item
+        self.conn.send_bytes(json.dumps([op, list(values[:-1]) + [pvText(values[-1])]]).encode())
+
+
+    def close(self):
+        self.conn.close()
+
+
+def forwardWrites(conn, writer: BatchWriter):
+    """
+    This function passes the writes of one client to the batch writer until the client disconnects
+    """
+    with conn:
+        while True:
+            try:
+                op, values = json.loads(conn.recv_bytes())
+            except EOFError:
+                return
+            except (ValueError, TypeError):
+                print('Dropping a client which sent an invalid write')
+                return
+            # Anything else would stop the writer thread once it reaches sqlite
+            if op not in WRITER_OPS or not isinstance(values, list) or not all(v is None or isinstance(v, (int, float, str)) for v in values):
+                print(f'Dropping a client which sent an invalid write: {op}')
+                return
+            writer.put((op, tuple(values)))
+
+
+def acceptClients(listener: Listener, writer: BatchWriter):
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, ConnectionError):
+            # A client with the wrong key mustn't stop the writer from accepting the others
+            continue
+        client = threading.Thread(target=forwardWrites, args=(conn, writer), daemon=True)
+        writer.clients.append(client)
+        client.start()
+
+
+def startWriter(name: str, authkey: bytes, address: tuple = ('localhost', 0), batchSize: int = 500, interval: float = 1) -> tuple:
+    """
+    This function starts the single writer of a database and accepts clients in a background thread.
+    authkey: bytes
+        The shared key clients have to know to connect
+    address: tuple
+        The address clients connect to, port 0 picks a free port
+    return -> tuple
+        The BatchWriter and the address of the listener
+    """
+    writer = BatchWriter(name, batchSize, interval)
+    writer.start()
+    listener = Listener(address, authkey=authkey)
+    threading.Thread(target=acceptClients, args=(listener, writer), daemon=True).start()
+    return writer, listener.address
+
+
+def serveWriter(name: str, authkey: bytes, address: tuple = WRITER_ADDRESS, batchSize: int = 500, interval: float = 1):
+    """
+    This function runs the single writer process of a database. Analysis processes connect to it with useWriter.
+    Readers still open the database themselves, WAL journaling gives them a consistent snapshot.
+    """
+    writer, address = startWriter(name, authkey, address, batchSize, interval)
+    print(f'Writing to {name}, listening on {address[0]}:{address[1]}')
+    writer.join()
+
+
+def useWriter(writer = None):
+    """
+    This function sends all writes of this process to a BatchWriter or a WriterClient.
+    If no writer is given, the process connects to the writer started with serveWriter, using the key in WRITER_AUTHKEY_VARIABLE.
+    """
+    if writer is None:
+        writer = WriterClient()
+    getStore().writer = writer
+    return writer
+
+
+def useBloomFilter(falsePositiveRate: float = 0.01):
+    return getStore().useBloomFilter(falsePositiveRate)
+
+
+def cacheStats() -> dict:
+    """
+    This function returns the hit, miss and eviction counters of the in-memory cache of this process
+    """
+    return getStore().cache.stats()
+
+
+def getStore(name: str = DB_PATH) -> EvalStore:
+    """
+    This function returns the EvalStore of this process for the given database.
+    The connection is opened on the first call and reused afterwards. A forked process gets its own connection.
+    """
+    global _store, _storePID
+    if _store is None or _store.name != name or _storePID != os.getpid():
+        _store = EvalStore(name)
+        _storePID = os.getpid()
+    return _store
+
+
+def closeStore():
+    """
+    This function closes the EvalStore of this process, which also saves a changed Bloom filter
+    """
+    global _store
+    if _store is not None and _storePID == os.getpid():
+        _store.close()
+    _store = None
+
+
+atexit.register(closeStore)
+
+
+def insert(position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None, key: int = None):
     """
     Inserting data into the table.
     Default values of nodes and depth are -1, if there is only an evaluation by LC0 or SF and not by both.
+    key is the hash from positionKey, see EvalStore.keyOf
     """
-    con = sqlite3.connect('../out/evaluation.db')
-    cursor = con.cursor()
-    cursor.execute(f'INSERT INTO eval VALUES ("{position}", "{nodes}", "{w}", "{d}", "{l}", "{depth}", "{cp}", "{mate}", "{pv}")')
-    con.commit()
+    getStore().insert(position, nodes, w, d, l, depth, cp, mate, pv, key=key)
 
 
-def update(position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None):
-    con = sqlite3.connect('../out/evaluation.db')
-    cur = con.cursor()
-    # TODO: update for CP
-    cur.execute(f'UPDATE eval SET nodes={nodes}, w={w}, d={d}, l={l} WHERE position="{position}"')
-    con.commit()
+def update(position: str, nodes: int = -1, w: int = None, d: int = None, l: int = None, depth: int = -1, cp: float = None, mate: int = None, pv: str = None, key: int = None):
+    getStore().update(position, nodes, w, d, l, depth, cp, mate, pv, key=key)
 
 
-def getEval(position: str):
-    con = sqlite3.connect('../out/evaluation.db')
-    cur = con.cursor()
-    if not contains(position):
-        return None
-    query = cur.execute(f'SELECT w,d,l,nodes,cp,depth FROM eval WHERE position="{position}"').fetchall()[0]
-    return {'cp': query[4], 'depth': query[5], 'wdl': [query[0], query[1], query[2]], 'nodes': query[3]}
+def getEval(position: str, key: int = None):
+    return getStore().getEval(position, key)
 
 
-def contains(position: str) -> bool:
-    con = sqlite3.connect('../out/evaluation.db')
-    cur = con.cursor()
-    if cur.execute(f'SELECT 1 FROM eval WHERE position="{position}"').fetchall():
-        return True
-    return False
+def addEval(position: str, engine: str, network: str = '', depth: int = 0, nodes: int = 0, cp: int = None, mate: int = None, w: int = None, d: int = None, l: int = None, pv: str = None, key: int = None):
+    getStore().addEval(position, engine, network, depth, nodes, cp, mate, w, d, l, pv, key=key)
+
+
+def getBestEval(position: str, minDepth: int = 0, minNodes: int = 0, wdl: bool = False, engine: str = None, network: str = None, key: int = None) -> dict:
+    return getStore().getBestEval(position, minDepth, minNodes, wdl, engine, network, key)
+
+
+def getEvals(positions: list, keys: list = None) -> dict:
+    return getStore().getEvals(positions, keys=keys)
+
+
+def getPV(position: str, key: int = None) -> list:
+    return getStore().getPV(position, key)
+
+
+def contains(position: str, key: int = None) -> bool:
+    return getStore().contains(position, key)
+
+
+def containsMany(positions: list, keys: list = None) -> set:
+    return getStore().containsMany(positions, keys=keys)
+
+
+def positionKey(board: chess.Board) -> int:
+    """
+    This function returns the key of a board for the lookups of this process, None if the database is keyed by the FEN.
+    Passing it with the position saves parsing the FEN again
+    """
+    return getStore().boardKey(board)
 
 
 def importFromPGN(pgnPath: str, nodes: int = None, depth: int = None):
@@ -82,19 +970,242 @@ def importFromPGN(pgnPath: str, nodes: int = None, depth: int = None):
                     update(fen, depth=depth, cp=cp)
 
 
+def parseLichessEval(line: bytes) -> tuple:
+    """
+    This function turns one line of the Lichess evaluation dump into a row of the eval table.
+    Only the first PV of the first evaluation is used and positions with a mate score are skipped.
+    return -> tuple
+        The row or None if there is no centipawn evaluation
+    """
+    entry = jsonParser.loads(line)
+    evals = entry['evals'][0]
+    pv = evals['pvs'][0]
+    if 'cp' not in pv:
+        return None
+    return (entry['fen'], -1, None, None, None, evals['depth'], pv['cp'], None, pv['line'])
+
+
+def importLichessEvals(lichessDB: str, chunkSize: int = 100000, startOffset: int = 0, store: EvalStore = None, pvLength: int = None, falsePositiveRate: float = 0.01) -> int:
+    """
+    This function streams the Lichess evaluation dump into the database.
+    The file is read in chunks of lines and every chunk is written in one transaction.
+    Positions which are already in the database are kept.
+    Afterwards the Bloom filter is built again, sized for the number of positions in the database after the import.
+    lichessDB: str
+        Path to the JSONL file, it can also be compressed with zstd (.zst)
+    chunkSize: int
+        The number of lines per transaction
+    startOffset: int
+        The byte offset (of the uncompressed stream) from which to continue a previous import
+    store: EvalStore
+        The database to write to, by default the one of this process
+    pvLength: int
+        The maximal number of moves of a stored PV, by default the limit of the store is used
+    falsePositiveRate: float
+        The false positive rate of the new Bloom filter
+    return -> int
+        The byte offset after the last imported line
+    """
+    if store is None:
+        store = getStore()
+    if pvLength is not None:
+        store.pvLength = pvLength
+    # A filter sized before the import would be overfilled by the new positions, it is replaced afterwards
+    store.bloom = None
+    if lichessDB.endswith('.zst'):
+        import zstandard
+        import io
+        dump = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(lichessDB, 'rb')))
+        # The compressed stream can't seek, so the already imported part is skipped
+        toSkip = startOffset
+        while toSkip > 0 and (block := dump.read(min(toSkip, 2**20))):
+            toSkip -= len(block)
+    else:
+        dump = open(lichessDB, 'rb')
+        dump.seek(startOffset)
+
+    offset = startOffset
+    imported = 0
+    start = time.time()
+    with dump:
+        while lines := list(itertools.islice(dump, chunkSize)):
+            rows = list()
+            for line in lines:
+                offset += len(line)
+                if row := parseLichessEval(line):
+                    rows.append(row)
+            store.insertMany(rows)
+            imported += len(lines)
+            print(f'{imported} lines, {imported/(time.time()-start):.0f} lines/s, offset {offset}')
+    store.useBloomFilter(falsePositiveRate, rebuild=True)
+    return offset
+
+
 def importFromLichessDB(lichessDB: str):
-    evalDB = pd.read_json(lichessDB, lines=True)
-    for i, row in evalDB.iterrows():
-        if i % 100000 == 0:
-            print(i)
-        if not contains(row['fen']):
-            evals = row['evals']
-            if 'cp' in evals[0]['pvs'][0].keys():
-                cp = evals[0]['pvs'][0]['cp']
-                pv = evals[0]['pvs'][0]['line']
-                # print(evals)
-                # print(row['fen'], cp, evals[0]['depth'], pv)
-                insert(position=row['fen'], cp=cp, depth=evals[0]['depth'], pv=pv)
+    importLichessEvals(lichessDB)
+
+
+def migrateToZobrist(oldDB: str, newDB: str, chunkSize: int = 100000) -> int:
+    """
+    This function copies an evaluation database with the FEN as key into a new database keyed by the Zobrist hash.
+    The table of all evaluations (evals) is copied as well.
+    oldDB: str
+        The filename of the existing database
+    newDB: str
+        The filename of the new database, which must not contain an eval table yet
+    chunkSize: int
+        The number of rows copied per transaction
+    return -> int
+        The number of rows which were dropped, since the position was already stored under a different FEN or due to a hash collision
+    """
+    createZobristTable(newDB)
+    new = EvalStore(newDB)
+    old = sqlite3.connect(oldDB)
+    rows = old.execute(f'SELECT {EVAL_COLUMNS} FROM eval')
+    before = new.cur.execute('SELECT COUNT(*) FROM eval').fetchone()[0]
+    total = 0
+    copied = 0
+    while chunk := rows.fetchmany(chunkSize):
+        new.insertMany(chunk)
+        total += len(chunk)
+        # Ignored rows are not inserted, so the table only grows by the copied rows
+        copied = new.cur.execute('SELECT COUNT(*) FROM eval').fetchone()[0] - before
+        print(f'{total} positions read, {copied} written')
+
+    # The table of all evaluations is keyed like the eval table, so its keys are replaced by the hashes as well
+    if old.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='evals'").fetchone():
+        rows = old.execute('SELECT position, engine, network, depth, nodes, cp, mate, w, d, l, pv FROM evals')
+        evals = 0
+        while chunk := rows.fetchmany(chunkSize):
+            new.cur.executemany('INSERT OR IGNORE INTO evals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [zobristKey(row[0]) + tuple(row[1:]) for row in chunk])
+            new.commit()
+            evals += len(chunk)
+            print(f'{evals} evaluations copied')
+    old.close()
+    new.close()
+    return total - copied
+
+
+def snapshotValue(value, dtype) -> int:
+    """
+    This function returns a database value as integer for the snapshot, or the missing value of the type.
+    Old rows contain the string 'None' instead of NULL.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    return np.iinfo(dtype).min
+
+
+def exportSnapshot(path: str, store: EvalStore = None, chunkSize: int = 100000) -> int:
+    """
+    This function writes a read-only snapshot of the database, sorted by the Zobrist hash of the positions.
+    Each position is a fixed-width record (see SNAPSHOT_DTYPE) and the file is a .npy file, so it can be memory-mapped.
+    path: str
+        The path of the snapshot
+    store: EvalStore
+        The database to export, by default the one of this process
+    return -> int
+        The number of positions in the snapshot
+    """
+    if store is None:
+        store = getStore()
+    columns = 'hash, cp, depth, w, d, l, nodes' if store.zobrist else 'position, cp, depth, w, d, l, nodes'
+    rows = store.con.execute(f'SELECT {columns} FROM eval')
+    records = list()
+    while chunk := rows.fetchmany(chunkSize):
+        for row in chunk:
+            key = row[0] if store.zobrist else zobristKey(row[0])[0]
+            records.append((key,) + tuple(snapshotValue(v, SNAPSHOT_DTYPE[i+1]) for i, v in enumerate(row[1:])))
+    data = np.array(records, dtype=SNAPSHOT_DTYPE)
+    # The same position might be stored under different FENs, only the first one is kept
+    _, first = np.unique(data['hash'], return_index=True)
+    data = data[first]
+
+    snapshot = np.lib.format.open_memmap(path, mode='w+', dtype=SNAPSHOT_DTYPE, shape=data.shape)
+    snapshot[:] = data
+    snapshot.flush()
+    return len(data)
+
+
+class EvalSnapshot:
+    """
+    This class reads a snapshot written by exportSnapshot.
+    The file is memory-mapped, so all processes share the same page-cached copy and no SQLite connection is needed.
+    Positions are found by binary search on the hashes, there is no collision check.
+    """
+    def __init__(self, path: str):
+        self.data = np.load(path, mmap_mode='r')
+        self.hashes = self.data['hash']
+
+
+    def find(self, keys: np.ndarray) -> tuple:
+        """
+        This function looks up an array of hashes
+        return -> tuple
+            The indices in the snapshot and a mask which of the hashes were found
+        """
+        idx = np.searchsorted(self.hashes, keys)
+        idx = np.minimum(idx, len(self.hashes) - 1)
+        found = self.hashes[idx] == keys if len(self.hashes) else np.zeros(len(keys), dtype=bool)
+        return idx, found
+
+
+    def recordToEval(self, record) -> dict:
+        values = dict()
+        for field in ['cp', 'depth', 'w', 'd', 'l', 'nodes']:
+            v = int(record[field])
+            values[field] = None if v == np.iinfo(SNAPSHOT_DTYPE[field]).min else v
+        return {'cp': values['cp'], 'depth': values['depth'], 'wdl': [values['w'], values['d'], values['l']], 'nodes': values['nodes']}
+
+
+    def getEval(self, position: str) -> dict:
+        """
+        This function returns the evaluation of a position in the same format as EvalStore.getEval or None
+        """
+        idx, found = self.find(np.array([zobristKey(position)[0]], dtype=np.int64))
+        if not found[0]:
+            return None
+        return self.recordToEval(self.data[idx[0]])
+
+
+    def getEvals(self, positions: list) -> dict:
+        """
+        This function looks up many positions with one vectorised binary search
+        return -> dict
+            The positions found in the snapshot as keys and their evaluations as values
+        """
+        positions = list(set(positions))
+        keys = np.array([zobristKey(p)[0] for p in positions], dtype=np.int64)
+        idx, found = self.find(keys)
+        return {positions[i]: self.recordToEval(self.data[idx[i]]) for i in np.flatnonzero(found)}
+
+
+def commandLine():
+    parser = argparse.ArgumentParser(
+            prog='Evaluation database',
+            description='This program maintains the evaluation database')
+    parser.add_argument('command', choices=['serve', 'import', 'bloom', 'snapshot'], help="serve: run the single writer for parallel analysis, import: import a Lichess evaluation dump, bloom: rebuild the Bloom filter, snapshot: export a read-only snapshot")
+    parser.add_argument('-d', '--database', default=DB_PATH, help="Path to the database")
+    parser.add_argument('-f', '--file', help="Path to the file to import or of the snapshot")
+    parser.add_argument('-p', '--port', default=WRITER_ADDRESS[1], help="Port of the writer")
+    parser.add_argument('-k', '--authkey', default=os.environ.get(WRITER_AUTHKEY_VARIABLE), help=f"Shared key of the writer and the analysis processes, the default is the environment variable {WRITER_AUTHKEY_VARIABLE}")
+    parser.add_argument('--offset', default=0, help="Byte offset from which to continue an import")
+    parser.add_argument('--fpr', default=0.01, help="False positive rate of the Bloom filter")
+    parser.add_argument('--pv-length', default=None, help="Maximal number of PV moves stored by an import")
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if not args.authkey:
+            parser.error(f'the writer needs a shared key, use --authkey or set {WRITER_AUTHKEY_VARIABLE}')
+        serveWriter(args.database, args.authkey.encode(), (WRITER_ADDRESS[0], int(args.port)))
+    elif args.command == 'import':
+        pvLength = int(args.pv_length) if args.pv_length else None
+        importLichessEvals(args.file, startOffset=int(args.offset), store=getStore(args.database), pvLength=pvLength, falsePositiveRate=float(args.fpr))
+    elif args.command == 'bloom':
+        getStore(args.database).useBloomFilter(float(args.fpr), rebuild=True)
+    elif args.command == 'snapshot':
+        print(f'{exportSnapshot(args.file, getStore(args.database))} positions exported')
 
 
 if __name__ == '__main__':
@@ -117,9 +1228,10 @@ if __name__ == '__main__':
     # con = sqlite3.connect(DBname)
     # cur = con.cursor()
     # print(cur.execute("SELECT * FROM eval").fetchall()[-100:])
-    for i in range(7, 10):
-        print(i)
-        importFromLichessDB(f'../resources/lichess_db_eval_1000000_{i}.json')
+    # for i in range(7, 10):
+    #     print(i)
+    #     importFromLichessDB(f'../resources/lichess_db_eval_1000000_{i}.json')
+    commandLine()
     """
     insert('test2', depth=5, cp=0.4, w=2, d=1, l=3)
     print(contains('test2'))
@@ -12,12 +12,22 @@ import functions
 from functions import configureEngine, sharpnessLC0
 import logging
 import evalDB
+import engines
+import telemetry
 import argparse
+import asyncio
+import io
+import itertools
+import json
+import multiprocessing.util
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
 import time
 
-def analyseGames(pgnPath: str, outfile: str, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int) -> None:
+def analyseGames(pgnPath: str, outfile: str, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int, network: str = '', adaptive: bool = False, twoPass: bool = False, queueSize: int = 8, backward: bool = False) -> None:
     """
     This function analyses a PGN and generates a new PGN with the analysis in the comments.
     It replaces the makeComments function
@@ -33,67 +43,794 @@ def analyseGames(pgnPath: str, outfile: str, sf: engine, lc0: engine, timeLimit:
         Time limit for the Stockfish analysis
     nodeLimit: int
         Node limit for the LC0 analysis
+    network: str
+        The network used by LC0, it is stored with the evaluations
+    adaptive: bool
+        If this is true, the Stockfish time of a game is distributed over its positions with a TimeBudget instead of timeLimit per position
+    twoPass: bool
+        If this is true, the games are analysed with analyseGameTwoPass
+    queueSize: int
+        The number of games the parser and the writer can be ahead of or behind the engines
+    backward: bool
+        If this is true, the positions of a game are analysed from the last to the first (see analyseGame)
+    The games are parsed in a separate thread (parseGames) and written by a separate thread (writeGames),
+    so parsing and writing overlap with the engine analysis.
+    The finished games are recorded in a journal next to the output file ('{outfile}.journal').
+    If the analysis is started again, the finished games are skipped and a partially written game is removed.
+    The positions of an unfinished game are already in evalDB, so the game continues where it stopped.
+    The journal also records the analysis settings, an unfinished analysis can't be resumed with other settings.
+    It is removed once all games are written. Only this function keeps a journal, analyseGamesParallel and
+    analyseGamesDeduplicated start again from the first game.
     """
-    gameNr = 1
-    totalGames = 0
-    with open(pgnPath, 'r') as pgn:
-        while chess.pgn.read_game(pgn):
-            totalGames += 1
+    totalGames = countGames(pgnPath)
+
+    journalPath = f'{outfile}.journal'
+    settings = {'timeLimit': timeLimit, 'nodeLimit': nodeLimit, 'network': network, 'adaptive': adaptive, 'twoPass': twoPass, 'backward': backward}
+    finished, end = readJournal(journalPath, pgnPath, outfile, settings)
+    if finished:
+        print(f'Resuming the analysis, {len(finished)} games are already finished')
+    if end is not None and os.path.getsize(outfile) > end:
+        os.truncate(outfile, end)
+
+    with open(journalPath, 'a' if end is not None else 'w') as journal:
+        if end is None:
+            start = os.path.getsize(outfile) if os.path.exists(outfile) else 0
+            journal.write(json.dumps({'pgn': os.path.abspath(pgnPath), 'end': start, 'settings': settings}) + '\n')
+
+        games = queue.Queue(maxsize=queueSize)
+        results = queue.Queue(maxsize=queueSize)
+        errors = list()
+        # The hashes of the positions are only needed by a hash keyed database
+        parser = threading.Thread(target=parseGames, args=(pgnPath, finished, games, errors, evalDB.getStore().zobrist), daemon=True)
+        writer = threading.Thread(target=writeGames, args=(outfile, journal, results, errors), daemon=True)
+        parser.start()
+        writer.start()
+        complete = False
+        try:
+            with tqdm(total=totalGames, initial=len(finished), leave=True, desc='Number of games') as progress:
+                while (item := games.get()) is not None:
+                    i, game, positions, keys = item
+                    gameStart = telemetry.clock()
+                    if twoPass:
+                        newGame = analyseGameTwoPass(game, sf, lc0, timeLimit, nodeLimit, network)
+                    else:
+                        newGame = analyseGame(game, sf, lc0, timeLimit, nodeLimit, network, adaptive=adaptive, positions=positions, backward=backward, keys=keys)
+                    telemetry.record('game', seconds=telemetry.clock() - gameStart)
+                    results.put((i, newGame))
+                    progress.update()
+                    if errors:
+                        break
+                else:
+                    complete = True
+        finally:
+            # The writer finishes the games which are already analysed
+            results.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+    # Otherwise running the same command again would skip all games instead of analysing them again
+    if complete:
+        os.remove(journalPath)
+
+
+def countGames(pgnPath: str) -> int:
+    """
+    This function counts the games of a PGN by the Event tags, which is much faster than parsing the games
+    """
+    count = 0
+    with open(pgnPath, 'rb') as pgn:
+        while chunk := pgn.read(1 << 24):
+            count += chunk.count(b'[Event ')
+    return count
 
-    with open(pgnPath, 'r') as pgn:
-        for i in tqdm(range(totalGames), leave=True, desc='Number of games'):
-            game = chess.pgn.read_game(pgn)
-            # print(f'Starting to analyse game {gameNr}')
-            gameNr += 1
 
-            whitePlayer = game.headers["White"].split(',')[0]
-            blackPlayer = game.headers["Black"].split(',')[0]
-            date = game.headers["Date"][:4]
+def parseGames(pgnPath: str, skip: set, games: queue.Queue, errors: list, hashKeys: bool = False):
+    """
+    This function is the parser stage of analyseGames. It reads the games of a PGN and puts them in a queue
+    together with the positions after every move (functions.modifyFEN) and their keys, ending with None.
+    pgnPath: str
+        Path to the PGN file
+    skip: set
+        The indices of the games which are already finished
+    games: queue.Queue
+        The queue for the tuples (index, game, positions, keys)
+    errors: list
+        An exception is added to this list
+    hashKeys: bool
+        If this is true, the keys are the hashes of the positions (evalDB.boardKey), otherwise they are None
+    """
+    try:
+        with open(pgnPath, 'r') as pgn:
+            i = 0
+            while True:
+                if i in skip:
+                    if not chess.pgn.skip_game(pgn):
+                        break
+                    i += 1
+                    continue
+                game = chess.pgn.read_game(pgn)
+                if game is None:
+                    break
+                board = game.board()
+                positions = list()
+                keys = list() if hashKeys else None
+                for move in game.mainline_moves():
+                    board.push(move)
+                    positions.append(functions.modifyFEN(board.fen()))
+                    if hashKeys:
+                        keys.append(evalDB.boardKey(board))
+                games.put((i, game, positions, keys))
+                i += 1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        games.put(None)
+
+
+def writeGames(outfile: str, journal, results: queue.Queue, errors: list):
+    """
+    This function is the writer stage of analyseGames. It writes the analysed games from the queue to the output file
+    with a single file handle and records every game in the journal after it is written.
+    outfile: str
+        The path to the output PGN file
+    journal
+        The open journal file
+    results: queue.Queue
+        The queue with the tuples (index, game), ending with None
+    errors: list
+        An exception is added to this list
+    """
+    try:
+        with open(outfile, 'a') as out:
+            while (item := results.get()) is not None:
+                i, newGame = item
+                start = telemetry.clock()
+                print(newGame, file=out, end='\n\n')
+                # The journal may only point to data which is in the file
+                out.flush()
+                journal.write(json.dumps({'game': i, 'end': out.tell()}) + '\n')
+                journal.flush()
+                telemetry.record('io', op='write', seconds=telemetry.clock() - start)
+    except Exception as e:
+        errors.append(e)
+        # The engine stage must not block on a full queue
+        while results.get() is not None:
+            pass
+
+
+def readJournal(journalPath: str, pgnPath: str, outfile: str, settings: dict = None) -> tuple:
+    """
+    This function reads the journal of an analysis started by analyseGames
+    settings: dict
+        The settings of the new analysis, a ValueError is raised if the journal was written with other settings
+    return -> tuple
+        The indices of the finished games and the size of the output file after the last finished game.
+        The size is None if there is no journal for this PGN and output file
+    """
+    if not os.path.exists(journalPath) or not os.path.exists(outfile):
+        return (set(), None)
+    finished = set()
+    end = None
+    with open(journalPath, 'r') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line might be cut off
+                break
+            if 'pgn' in entry and entry['pgn'] != os.path.abspath(pgnPath):
+                return (set(), None)
+            # Journals of older versions have no settings
+            if settings is not None and entry.get('settings', settings) != settings:
+                raise ValueError(f'{journalPath} belongs to an unfinished analysis with the settings {entry["settings"]}. '
+                                 f'Resume it with these settings, or delete the journal and {outfile} to start again')
+            if 'game' in entry:
+                finished.add(entry['game'])
+            end = entry['end']
+    return (finished, end)
+
+
+def analyseGame(game: chess.pgn.Game, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int, network: str = '', progress: bool = True, adaptive: bool = False, positions: list = None, backward: bool = False, keys: list = None) -> chess.pgn.Game:
+    """
+    This function analyses the mainline of a game and returns a new game with the evaluations as comments.
+    game: chess.pgn.Game
+        The game to analyse
+    progress: bool
+        If this is true, a progress bar of the moves is shown
+    adaptive: bool
+        If this is true, the game gets a TimeBudget of timeLimit per position
+    positions: list
+        The positions after every move (functions.modifyFEN), if they are already known
+    keys: list
+        The keys of these positions for evalDB (evalDB.positionKey), if they are already known
+    backward: bool
+        If this is true, the positions are analysed from the last to the first.
+        The engines only get ucinewgame before a new game, so the refutations in their hash from the later positions
+        are used for the earlier ones, which gives deeper evaluations in the same time
+    The other arguments are the same as for analyseGames
+    return -> chess.pgn.Game
+        The game with the analysis in the comments
+    """
+    whitePlayer = game.headers["White"].split(',')[0]
+    blackPlayer = game.headers["Black"].split(',')[0]
+    date = game.headers["Date"][:4]
+
+    board = game.board()
+
+    newGame = chess.pgn.Game()
+    newGame.headers = game.headers
+    node = newGame
+
+    moves = list(game.mainline_moves())
+    # Looking up the whole game at once, so only the cache misses are sent to the engines
+    gamePositions = positions
+    if gamePositions is None:
+        prefetchBoard = game.board()
+        gamePositions = list()
+        keys = list()
+        for move in moves:
+            prefetchBoard.push(move)
+            gamePositions.append(functions.modifyFEN(prefetchBoard.fen()))
+            keys.append(evalDB.positionKey(prefetchBoard))
+    keys = keys or [None] * len(gamePositions)
+    start = telemetry.clock()
+    cached = evalDB.getEvals(gamePositions, keys)
+    telemetry.record('io', op='getEvals', seconds=telemetry.clock() - start)
+    budget = TimeBudget(timeLimit * len(gamePositions), len(gamePositions)) if adaptive else None
+
+    if backward:
+        for move in moves:
+            board.push(move)
+        comments = [None] * len(moves)
+        for j in tqdm(reversed(range(len(moves))), total=len(moves), leave=False, desc=f'{whitePlayer}-{blackPlayer}, {date}', disable=not progress):
+            # The game is the key of the engines, they only clear their hash when it changes
+            comments[j] = evaluatePosition(board, gamePositions[j], cached, sf, lc0, timeLimit, nodeLimit, network, budget, game=game, key=keys[j])
+            board.pop()
+        for move, comment in zip(moves, comments):
+            node = node.add_variation(move)
+            if comment:
+                node.comment = comment
+        return newGame
+
+    for j, move in enumerate(tqdm(moves, leave=False, desc=f'{whitePlayer}-{blackPlayer}, {date}', disable=not progress)):
+        node = node.add_variation(move)
+        board.push(move)
+
+        comment = evaluatePosition(board, gamePositions[j], cached, sf, lc0, timeLimit, nodeLimit, network, budget, key=keys[j])
+        if comment:
+            node.comment = comment
+    return newGame
+
+
+def analyseGameTwoPass(game: chess.pgn.Game, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int, network: str = '', coarseDepth: int = 10, coarseNodes: int = 100, swing: float = 5, window: int = 1, progress: bool = True) -> chess.pgn.Game:
+    """
+    This function analyses a game in two passes. The first pass evaluates every position with a shallow search.
+    Only the positions around large changes of the expected score are then analysed at full strength with evaluatePosition,
+    since the mistakes and the accuracy depend on those positions. The other positions keep the shallow evaluation.
+    game: chess.pgn.Game
+        The game to analyse
+    coarseDepth: int
+        The Stockfish depth of the first pass
+    coarseNodes: int
+        The LC0 nodes of the first pass
+    swing: float
+        The change of the expected score (0-100) between two plies which makes them critical.
+        It is lower than the inaccuracy threshold (10) since the shallow evaluations aren't exact
+    window: int
+        The number of plies around a swing which are analysed at full strength as well
+    The other arguments are the same as for analyseGame
+    return -> chess.pgn.Game
+        The game with the analysis in the comments
+    """
+    boards = list()
+    board = game.board()
+    for move in game.mainline_moves():
+        board.push(move)
+        boards.append(board.copy(stack=False))
+    gamePositions = [functions.modifyFEN(b.fen()) for b in boards]
+    keys = [evalDB.positionKey(b) for b in boards]
+    start = telemetry.clock()
+    cached = evalDB.getEvals(gamePositions, keys)
+    telemetry.record('io', op='getEvals', seconds=telemetry.clock() - start)
+
+    # The shallow evaluations aren't stored in evalDB, they would count as real Stockfish evaluations later
+    scores = list()
+    for b, posDB in tqdm(list(zip(boards, gamePositions)), leave=False, desc='First pass', disable=not progress):
+        if b.is_game_over():
+            scores.append(None)
+        elif posDB in cached and cached[posDB]['depth'] > 0 and cached[posDB]['nodes'] >= nodeLimit:
+            scores.append((cached[posDB]['wdl'], cached[posDB]['cp']))
+        else:
+            start = telemetry.clock()
+            info = sf.analyse(b, chess.engine.Limit(depth=coarseDepth))
+            telemetry.recordEngine('stockfish', sf.id.get('name', 'stockfish'), info, telemetry.clock() - start, b.fen())
+            cp = int(formatInfo(infoSF=info))
+            if nodeLimit > 0:
+                start = telemetry.clock()
+                info = lc0.analyse(b, chess.engine.Limit(nodes=coarseNodes))
+                telemetry.recordEngine('lc0', lc0.id.get('name', 'lc0'), info, telemetry.clock() - start, b.fen())
+                wdl = functions.formatWDL(info['wdl'])
+            else:
+                wdl = None
+            scores.append((wdl, cp))
+
+    critical = criticalPlies([s[1] if s else None for s in scores], swing, window)
+    logging.info(f'{len(critical)} of {len(boards)} plies are analysed at full strength')
+
+    newGame = chess.pgn.Game()
+    newGame.headers = game.headers
+    node = newGame
+    for j, move in enumerate(tqdm(list(game.mainline_moves()), leave=False, desc='Second pass', disable=not progress)):
+        node = node.add_variation(move)
+        if j in critical:
+            comment = evaluatePosition(boards[j], gamePositions[j], cached, sf, lc0, timeLimit, nodeLimit, network, key=keys[j])
+        elif scores[j]:
+            wdl, cp = scores[j]
+            comment = f'{str(wdl)};{cp}' if wdl else str(cp)
+        else:
+            comment = None
+        if comment:
+            node.comment = comment
+    return newGame
+
+
+def criticalPlies(cps: list, swing: float = 5, window: int = 1) -> set:
+    """
+    This function finds the plies around large changes of the expected score (functions.expectedScore)
+    cps: list
+        The centipawn evaluations (white's perspective) after every ply, None if the game is over
+    swing: float
+        The change of the expected score which counts as large
+    window: int
+        The number of plies before and after the change which are added
+    return -> set
+        The indices of the critical plies
+    """
+    critical = set()
+    for j in range(1, len(cps)):
+        if cps[j] is None or cps[j-1] is None:
+            continue
+        if abs(functions.expectedScore(cps[j]) - functions.expectedScore(cps[j-1])) >= swing:
+            # Both positions are needed for the loss of the move
+            critical.update(range(max(0, j-1-window), min(len(cps), j+1+window)))
+    return critical
+
 
+def planAnalysis(pgnPath: str) -> dict:
+    """
+    This function scans a PGN and collects the unique positions of all games, since tournament games share long opening lines.
+    Positions are compared without the move counters (functions.modifyFEN).
+    pgnPath: str
+        Path to the PGN file
+    return -> dict
+        'games': the games, 'positions': the unique positions with the first full FEN reaching them,
+        'origins': the index of the first game reaching a unique position and the number of moves played until then,
+        'keys': the keys of the unique positions for evalDB (evalDB.positionKey), 'plies': the number of plies of all games
+    """
+    games = list()
+    positions = dict()
+    origins = dict()
+    keys = dict()
+    plies = 0
+    with open(pgnPath, 'r') as pgn:
+        while game := chess.pgn.read_game(pgn):
+            games.append(game)
             board = game.board()
+            for ply, move in enumerate(game.mainline_moves(), start=1):
+                board.push(move)
+                plies += 1
+                fen = board.fen()
+                posDB = functions.modifyFEN(fen)
+                if posDB not in positions:
+                    positions[posDB] = fen
+                    # Only the origin is kept, a move stack for every position would need memory quadratic in the game length
+                    origins[posDB] = (len(games) - 1, ply)
+                    keys[posDB] = evalDB.positionKey(board)
+    return {'games': games, 'positions': positions, 'origins': origins, 'keys': keys, 'plies': plies}
+
+
+def replayGame(game: chess.pgn.Game, ply: int) -> Board:
+    """
+    This function returns the board of a game after the first moves. The moves are in its move stack,
+    so the engines see the history of the position, which matters for repetitions and the fifty move rule.
+    ply: int
+        The number of moves to play
+    """
+    board = game.board()
+    for move in itertools.islice(game.mainline_moves(), ply):
+        board.push(move)
+    return board
+
 
+def analyseGamesDeduplicated(pgnPath: str, outfile: str, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int, network: str = '', adaptive: bool = False) -> dict:
+    """
+    This function analyses every unique position of a PGN exactly once and then writes the comments to all games reaching it.
+    The arguments are the same as for analyseGames, with adaptive the budget is shared by the whole PGN.
+    There is no journal, the games are only written once all positions are analysed. An interrupted analysis
+    starts again from the first position, but the positions saved in evalDB before aren't analysed again.
+    return -> dict
+        The number of plies, unique positions, cache hits and engine calls saved by the deduplication
+    """
+    plan = planAnalysis(pgnPath)
+    positions = plan['positions']
+    origins = plan['origins']
+    keys = plan['keys']
+    start = telemetry.clock()
+    cached = evalDB.getEvals(list(positions.keys()), list(keys.values()))
+    telemetry.record('io', op='getEvals', seconds=telemetry.clock() - start)
+    stats = {'plies': plan['plies'], 'uniquePositions': len(positions), 'cacheHits': len(cached), 'engineCallsSaved': plan['plies'] - len(positions)}
+    print(f"{stats['plies']} plies, {stats['uniquePositions']} unique positions ({stats['cacheHits']} in the database), {stats['engineCallsSaved']} engine calls saved")
+
+    comments = dict()
+    budget = TimeBudget(timeLimit * len(positions), len(positions)) if adaptive else None
+    for posDB in tqdm(positions, desc='Unique positions'):
+        # The position is analysed with the moves of the first game reaching it, other games might reach it with another history
+        i, ply = origins[posDB]
+        board = replayGame(plan['games'][i], ply)
+        comments[posDB] = evaluatePosition(board, posDB, cached, sf, lc0, timeLimit, nodeLimit, network, budget, key=keys[posDB])
+
+    writeAnnotatedGames(plan['games'], comments, outfile)
+    return stats
+
+
+def writeAnnotatedGames(games: list, comments: dict, outfile: str):
+    """
+    This function writes games with the comments of their positions to a PGN file
+    games: list
+        The games
+    comments: dict
+        The comment for every position (functions.modifyFEN) reached in the games, None for no comment
+    outfile: str
+        The path to the output PGN file, the games are appended
+    """
+    with open(outfile, 'a+') as out:
+        for game in games:
             newGame = chess.pgn.Game()
             newGame.headers = game.headers
             node = newGame
-
-            for j in tqdm(range(len(list(game.mainline_moves()))), leave=False, desc=f'{whitePlayer}-{blackPlayer}, {date}'):
-                move = list(game.mainline_moves())[j]
+            board = game.board()
+            for move in game.mainline_moves():
                 node = node.add_variation(move)
                 board.push(move)
+                if comment := comments[functions.modifyFEN(board.fen())]:
+                    node.comment = comment
+            print(newGame, file=out, end='\n\n')
 
 
-                pos = board.fen()
-                posDB = functions.modifyFEN(pos)
-                if evalDB.contains(posDB):
-                    evalDict = evalDB.getEval(posDB)
-                    wdl = evalDict['wdl']
-                    cp = evalDict['cp']
-                    if evalDict['depth'] <= 0:
-                        info = analysisCP(board, sf, timeLimit)
-                        cp = info['score']
-                        depth = info['depth']
-                        evalDB.update(position=posDB, cp=cp, depth=depth)
-                    if evalDict['nodes'] < nodeLimit:
-                        info = analysisWDL(board, lc0, nodeLimit)
-                        wdl = list(chess.engine.PovWdl.white(info['wdl']))
-                        evalDB.update(position=posDB, nodes=nodeLimit, w=wdl[0], d=wdl[1], l=wdl[2])
-                    node.comment = f'{str(wdl)};{cp}'
-                else:
-                    iSF = analysisCP(board, sf, timeLimit)
-                    if iSF:
-                        if nodeLimit > 0:
-                            iLC0 = analysisWDL(board, lc0, nodeLimit)
-                            ana = formatInfo(iLC0, iSF)
-                            node.comment = ana
-                            cp = int(ana.split(';')[1])
-                            wdl = [ int(w) for w in ana.split(';')[0].replace('[', '').replace(']', '').strip().split(',') ]
-                            evalDB.insert(posDB, nodes=nodeLimit, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=iSF['depth'])
-                        else:
-                            ana = formatInfo(infoSF = iSF)
-                            node.comment = ana
-                            cp = int(ana)
-                            evalDB.insert(posDB, nodes=nodeLimit, cp=cp, w=0, d=0, l=0, depth=iSF['depth'])
-            print(newGame, file=open(outfile, 'a+'), end='\n\n')
+# Engines and limits of a worker process of analyseGamesParallel
+_worker = dict()
+
+
+def initWorker(sfCommand: str, sfOptions: dict, lc0Command: str, lc0Options: dict, timeLimit: int, nodeLimit: int, network: str, writerAddress: tuple, writerKey: bytes, adaptive: bool = False, telemetryPath: str = None, backward: bool = False, bloom: bool = False):
+    """
+    This function starts the engines of a worker process and sends its database writes to the writer of the main process
+    """
+    if telemetryPath:
+        telemetry.useTelemetry(telemetryPath)
+    sf = engines.getEngine(sfCommand, sfOptions)
+    lc0 = engines.getEngine(lc0Command, lc0Options)
+    # Worker processes don't run atexit handlers, so the engines are closed by a multiprocessing finalizer
+    multiprocessing.util.Finalize(None, engines.closeEngines, exitpriority=10)
+    _worker.update({'sf': sf, 'lc0': lc0, 'timeLimit': timeLimit, 'nodeLimit': nodeLimit, 'network': network, 'adaptive': adaptive, 'backward': backward})
+    evalDB.useWriter(evalDB.WriterClient(writerAddress, writerKey))
+    if bloom:
+        evalDB.useBloomFilter()
+
+
+def analyseGameWorker(gameText: str, submitted: float = None) -> str:
+    """
+    This function analyses one game (as PGN string) in a worker process and returns the annotated game as string.
+    submitted is the time the game was given to the pool, it is used for the queue wait in the telemetry
+    """
+    queueWait = time.time() - submitted if submitted else None
+    start = telemetry.clock()
+    game = chess.pgn.read_game(io.StringIO(gameText))
+    newGame = analyseGame(game, _worker['sf'], _worker['lc0'], _worker['timeLimit'], _worker['nodeLimit'], _worker['network'], progress=False, adaptive=_worker['adaptive'], backward=_worker['backward'])
+    telemetry.record('game', seconds=telemetry.clock() - start, queueWait=queueWait)
+    return str(newGame)
+
+
+def analyseGamesParallel(pgnPath: str, outfile: str, workers: int, sfOptions: dict, lc0Options: dict, timeLimit: int, nodeLimit: int, network: str = '', sfCommand: str = 'stockfish', lc0Command: str = 'lc0', adaptive: bool = False, backward: bool = False, bloom: bool = False) -> None:
+    """
+    This function analyses the games of a PGN with a pool of worker processes, each with its own Stockfish and LC0.
+    The games are written to the output file in their original order.
+    pgnPath: str
+        Path to the PGN file with the games to analyse
+    outfile: str
+        The path to the output PGN file
+    workers: int
+        The number of worker processes
+    sfOptions: dict
+        UCI options of Stockfish. Threads and Hash are the budget of all workers together and are split between them
+    lc0Options: dict
+        UCI options of each LC0
+    timeLimit: int
+        Time limit for the Stockfish analysis
+    nodeLimit: int
+        Node limit for the LC0 analysis
+    network: str
+        The network used by LC0, it is stored with the evaluations
+    adaptive: bool
+        If this is true, every game gets a TimeBudget (see analyseGames)
+    backward: bool
+        If this is true, the positions of every game are analysed from the last to the first (see analyseGame)
+    bloom: bool
+        If this is true, the workers skip database lookups of positions which are not in the Bloom filter
+    There is no journal like in analyseGames. An interrupted analysis has to be started again with a new output file,
+    the positions saved in evalDB before aren't analysed again.
+    """
+    workerOptions = dict(sfOptions)
+    if 'Threads' in sfOptions:
+        workerOptions['Threads'] = str(max(1, int(sfOptions['Threads']) // workers))
+    if 'Hash' in sfOptions:
+        workerOptions['Hash'] = str(max(16, int(sfOptions['Hash']) // workers))
+
+    games = list()
+    with open(pgnPath, 'r') as pgn:
+        while game := chess.pgn.read_game(pgn):
+            games.append(str(game))
+
+    # The workers can't write to the database themselves without locking each other out
+    # A fresh key for every run, the workers get it with their arguments
+    writerKey = os.urandom(32)
+    writer, address = evalDB.startWriter(evalDB.getStore().name, writerKey)
+    if bloom:
+        # The filter is built here if there is none, so the workers only load it
+        evalDB.useBloomFilter()
+    initArgs = (sfCommand, workerOptions, lc0Command, lc0Options, timeLimit, nodeLimit, network, address, writerKey, adaptive, telemetry.currentPath(), backward, bloom)
+    with ProcessPoolExecutor(workers, initializer=initWorker, initargs=initArgs) as executor:
+        with open(outfile, 'a+') as out:
+            submitted = [time.time()] * len(games)
+            for gameText in tqdm(executor.map(analyseGameWorker, games, submitted), total=len(games), desc='Number of games'):
+                start = telemetry.clock()
+                print(gameText, file=out, end='\n\n')
+                out.flush()
+                telemetry.record('io', op='write', seconds=telemetry.clock() - start)
+    writer.close()
+
+
+def evaluatePosition(board: Board, posDB: str, cached: dict, sf: engine, lc0: engine, timeLimit: int, nodeLimit: int, network: str = '', budget = None, game = None, key: int = None) -> str:
+    """
+    This function returns the evaluation comment for a position.
+    Stored evaluations are used if they are strong enough, otherwise the position is analysed and the results are saved in evalDB.
+    board: Board
+        The position
+    posDB: str
+        The FEN of the position without move counters
+    cached: dict
+        The evaluations from evalDB.getEvals, new evaluations are added to it
+    sf, lc0: engine
+        The configured engines
+    timeLimit: int
+        Time limit for the Stockfish analysis
+    nodeLimit: int
+        Node limit for the LC0 analysis
+    network: str
+        The network used by LC0
+    budget: TimeBudget
+        If this is set, the Stockfish time comes from the budget instead of timeLimit
+    game
+        The game the position belongs to, the engines get ucinewgame when it changes
+    key: int
+        The key of the position for evalDB (evalDB.positionKey), so evalDB doesn't have to parse the FEN
+    return -> str
+        The comment ('[w, d, l];cp') or None if the game is over
+    """
+    positionStart = telemetry.clock()
+    inCache = posDB in cached
+    needsSF, needsLC0 = missingAnalysis(board, posDB, cached, nodeLimit, network, key)
+    telemetry.record('io', op='lookup', seconds=telemetry.clock() - positionStart)
+    iSF = analysisCP(board, sf, timeLimit, budget, game) if needsSF else None
+    if budget and not needsSF:
+        # The position was counted in the budget, its share goes to the remaining positions
+        budget.spend(0)
+    iLC0 = analysisWDL(board, lc0, nodeLimit, game=game) if needsLC0 else None
+    start = telemetry.clock()
+    comment = saveAnalysis(posDB, cached, iSF, iLC0, sf.id.get('name', 'stockfish'), lc0.id.get('name', 'lc0'), nodeLimit, network, key)
+    telemetry.record('io', op='save', seconds=telemetry.clock() - start)
+    if inCache or needsSF or needsLC0:
+        cache = 'miss' if not inCache else ('partial' if needsSF or needsLC0 else 'hit')
+        telemetry.record('position', cache=cache, seconds=telemetry.clock() - positionStart, position=posDB)
+    return comment
+
+
+def missingAnalysis(board: Board, posDB: str, cached: dict, nodeLimit: int, network: str = '', key: int = None) -> tuple:
+    """
+    This function checks which engines still need to analyse a position.
+    If evalDB has a strong enough evaluation from an earlier run, it is used for the position instead.
+    The arguments are the same as for evaluatePosition
+    return -> tuple
+        Two booleans, if Stockfish and if LC0 have to analyse the position
+    """
+    if board.is_game_over():
+        return (False, False)
+    if posDB not in cached:
+        return (True, nodeLimit > 0)
+
+    evalDict = cached[posDB]
+    needsSF = False
+    needsLC0 = False
+    if evalDict['depth'] <= 0:
+        # An earlier run might have stored a Stockfish evaluation next to the main one
+        if best := evalDB.getBestEval(posDB, minDepth=1, key=key):
+            evalDB.update(position=posDB, cp=best['cp'], depth=best['depth'], pv=best['pv'], key=key)
+            evalDict['depth'] = best['depth']
+            evalDict['cp'] = best['cp']
+        else:
+            needsSF = True
+    if evalDict['nodes'] < nodeLimit:
+        if best := evalDB.getBestEval(posDB, minNodes=nodeLimit, wdl=True, network=network or None, key=key):
+            evalDB.update(position=posDB, nodes=best['nodes'], w=best['wdl'][0], d=best['wdl'][1], l=best['wdl'][2], key=key)
+            evalDict['nodes'] = best['nodes']
+            evalDict['wdl'] = best['wdl']
+        else:
+            needsLC0 = True
+    return (needsSF, needsLC0)
+
+
+def saveAnalysis(posDB: str, cached: dict, iSF: dict, iLC0: dict, sfName: str, lc0Name: str, nodeLimit: int, network: str = '', key: int = None) -> str:
+    """
+    This function saves the engine analysis of a position in evalDB and returns the comment for the position.
+    posDB: str
+        The FEN of the position without move counters
+    cached: dict
+        The evaluations from evalDB.getEvals, the new evaluation is added to it
+    iSF, iLC0: dict
+        The infos of the Stockfish and LC0 analysis, None if the engine didn't analyse the position
+    sfName, lc0Name: str
+        The names of the engines, they are stored with the evaluations
+    nodeLimit: int
+        Node limit for the LC0 analysis
+    network: str
+        The network used by LC0
+    key: int
+        The key of the position for evalDB (evalDB.positionKey)
+    return -> str
+        The comment ('[w, d, l];cp') or None if the game is over
+    """
+    if iSF:
+        cp = int(formatInfo(infoSF=iSF))
+        evalDB.addEval(posDB, sfName, depth=iSF['depth'], nodes=iSF.get('nodes', 0), cp=cp, pv=iSF.get('pv'), key=key)
+    if iLC0:
+        wdl = functions.formatWDL(iLC0['wdl'])
+        evalDB.addEval(posDB, lc0Name, network, depth=iLC0.get('depth', 0), nodes=nodeLimit, w=wdl[0], d=wdl[1], l=wdl[2], key=key)
+
+    if posDB in cached:
+        evalDict = cached[posDB]
+        if iSF:
+            evalDB.update(position=posDB, cp=cp, depth=iSF['depth'], pv=iSF.get('pv'), key=key)
+            evalDict['depth'] = iSF['depth']
+            evalDict['cp'] = cp
+        if iLC0:
+            evalDB.update(position=posDB, nodes=nodeLimit, w=wdl[0], d=wdl[1], l=wdl[2], key=key)
+            evalDict['nodes'] = nodeLimit
+            evalDict['wdl'] = wdl
+        return f'{str(evalDict["wdl"])};{evalDict["cp"]}'
+
+    if not iSF:
+        return None
+    if iLC0:
+        comment = formatInfo(iLC0, iSF)
+    else:
+        wdl = [0, 0, 0]
+        comment = formatInfo(infoSF=iSF)
+    evalDB.insert(posDB, nodes=nodeLimit if iLC0 else 0, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=iSF['depth'], pv=iSF.get('pv'), key=key)
+    # Repeated positions in the same game are now cache hits
+    cached[posDB] = {'cp': cp, 'depth': iSF['depth'], 'wdl': wdl, 'nodes': nodeLimit if iLC0 else 0}
+    return comment
+
+
+async def analyseGameAsync(game: chess.pgn.Game, sf: engine.Protocol, lc0: engine.Protocol, timeLimit: int, nodeLimit: int, network: str = '') -> chess.pgn.Game:
+    """
+    This function analyses a game like analyseGame, but Stockfish and LC0 run at the same time.
+    Each engine works through its own queue of positions, so an engine starts the next ply while the other one is still busy.
+    The results are saved in the order of the moves as soon as both engines are done with a position.
+    sf, lc0: engine.Protocol
+        The engines started with chess.engine.popen_uci
+    The other arguments are the same as for analyseGames
+    return -> chess.pgn.Game
+        The game with the analysis in the comments
+    """
+    boards = list()
+    board = game.board()
+    for move in game.mainline_moves():
+        board.push(move)
+        boards.append(board.copy(stack=False))
+    gamePositions = [functions.modifyFEN(b.fen()) for b in boards]
+    keys = dict(zip(gamePositions, [evalDB.positionKey(b) for b in boards]))
+    start = telemetry.clock()
+    cached = evalDB.getEvals(gamePositions, [keys[posDB] for posDB in gamePositions])
+    telemetry.record('io', op='getEvals', seconds=telemetry.clock() - start)
+    inCache = {posDB for posDB in gamePositions if posDB in cached}
+
+    sfJobs = dict()
+    lc0Jobs = dict()
+    for b, posDB in zip(boards, gamePositions):
+        if posDB in sfJobs or posDB in lc0Jobs:
+            continue
+        needsSF, needsLC0 = missingAnalysis(b, posDB, cached, nodeLimit, network, keys[posDB])
+        if needsSF:
+            sfJobs[posDB] = b
+        if needsLC0:
+            lc0Jobs[posDB] = b
+
+    loop = asyncio.get_running_loop()
+    results = {posDB: (loop.create_future(), loop.create_future()) for posDB in gamePositions}
+
+    async def runEngine(eng: engine.Protocol, jobs: dict, limit: chess.engine.Limit, index: int):
+        try:
+            for posDB, b in jobs.items():
+                start = telemetry.clock()
+                info = await eng.analyse(b, limit)
+                telemetry.recordEngine(('stockfish', 'lc0')[index], eng.id.get('name'), info, telemetry.clock() - start, b.fen())
+                results[posDB][index].set_result(info)
+        except Exception as error:
+            # The positions waiting for this engine would never finish otherwise
+            for posDB in jobs:
+                if not results[posDB][index].done():
+                    results[posDB][index].set_exception(error)
+            raise
+
+    tasks = [asyncio.create_task(runEngine(sf, sfJobs, chess.engine.Limit(time=timeLimit), 0)),
+             asyncio.create_task(runEngine(lc0, lc0Jobs, chess.engine.Limit(nodes=nodeLimit), 1))]
+
+    newGame = chess.pgn.Game()
+    newGame.headers = game.headers
+    node = newGame
+    comments = dict()
+    sfName = sf.id.get('name', 'stockfish')
+    lc0Name = lc0.id.get('name', 'lc0')
+    try:
+        for move, posDB in zip(game.mainline_moves(), gamePositions):
+            node = node.add_variation(move)
+            if posDB not in comments:
+                waitStart = telemetry.clock()
+                iSF = await results[posDB][0] if posDB in sfJobs else None
+                iLC0 = await results[posDB][1] if posDB in lc0Jobs else None
+                queueWait = telemetry.clock() - waitStart
+                start = telemetry.clock()
+                comments[posDB] = saveAnalysis(posDB, cached, iSF, iLC0, sfName, lc0Name, nodeLimit, network, keys[posDB])
+                telemetry.record('io', op='save', seconds=telemetry.clock() - start)
+                needed = posDB in sfJobs or posDB in lc0Jobs
+                if posDB in inCache or needed:
+                    cache = 'miss' if posDB not in inCache else ('partial' if needed else 'hit')
+                    telemetry.record('position', cache=cache, queueWait=queueWait, position=posDB)
+            if comments[posDB]:
+                node.comment = comments[posDB]
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return newGame
+
+
+async def analyseGamesAsync(pgnPath: str, outfile: str, sfOptions: dict, lc0Options: dict, timeLimit: int, nodeLimit: int, network: str = '', sfCommand: str = 'stockfish', lc0Command: str = 'lc0') -> None:
+    """
+    This function analyses a PGN like analyseGames, but Stockfish and LC0 analyse the positions at the same time.
+    The time per move is then about the time of the slower engine instead of the sum of both.
+    sfOptions, lc0Options: dict
+        The UCI options of the engines
+    sfCommand, lc0Command: str
+        The commands to start the engines
+    The other arguments are the same as for analyseGames
+    """
+    _, sf = await chess.engine.popen_uci(sfCommand)
+    _, lc0 = await chess.engine.popen_uci(lc0Command)
+    try:
+        await sf.configure(sfOptions)
+        await lc0.configure(lc0Options)
+        with open(pgnPath, 'r') as pgn, open(outfile, 'a+') as out:
+            with tqdm(desc='Number of games') as progress:
+                while game := chess.pgn.read_game(pgn):
+                    newGame = await analyseGameAsync(game, sf, lc0, timeLimit, nodeLimit, network)
+                    start = telemetry.clock()
+                    print(newGame, file=out, end='\n\n')
+                    out.flush()
+                    telemetry.record('io', op='write', seconds=telemetry.clock() - start)
+                    progress.update()
+    finally:
+        await sf.quit()
+        await lc0.quit()
 
 
 
@@ -175,7 +912,7 @@ def makeComments(gamesFile: str, outfile: str, analysis, limit: int, engine: eng
     return []
 
 
-def analysisWDL(position: Board, lc0: engine, limit: int, time: bool = False):
+def analysisWDL(position: Board, lc0: engine, limit: int, time: bool = False, game = None):
     """
     This function analyses a given chess position with LC0 to get the WDL from whtie's perspective.
     position:Board
@@ -186,6 +923,8 @@ def analysisWDL(position: Board, lc0: engine, limit: int, time: bool = False):
         The limit for the analysis, default is nodes, but time can also be selected
     time:bool = False
         If this is true, the limit will be for the time in seconds
+    game = None
+        The game of the position, LC0 gets ucinewgame if it differs from the last analysis
     return -> str
         The formated WDL
     """
@@ -193,14 +932,16 @@ def analysisWDL(position: Board, lc0: engine, limit: int, time: bool = False):
     if position.is_game_over():
         return None
     
+    start = telemetry.clock()
     if time:
-        info = lc0.analyse(position, chess.engine.Limit(time=limit))
+        info = lc0.analyse(position, chess.engine.Limit(time=limit), game=game)
     else:
-        info = lc0.analyse(position, chess.engine.Limit(nodes=limit))
+        info = lc0.analyse(position, chess.engine.Limit(nodes=limit), game=game)
+    telemetry.recordEngine('lc0', lc0.id.get('name', 'lc0'), info, telemetry.clock() - start, position.fen())
     return info
 
 
-def analysisCP(position: Board, sf: engine, timeLimit: int):
+def analysisCP(position: Board, sf: engine, timeLimit: int, budget = None, game = None):
     """
     This function analyses a given position with Stockfish and returns the centipawn score.
     position: Board:
@@ -209,19 +950,137 @@ def analysisCP(position: Board, sf: engine, timeLimit: int):
         Stockfish as a configured chess engine
     timeLimit:int
         The time in seconds spent on the position
+    budget: TimeBudget
+        If this is set, the analysis stops as soon as the evaluation is stable and the time comes from the budget
+    game
+        The game of the position, Stockfish gets ucinewgame if it differs from the last analysis
     return -> str
         The centipawn score
     """
-    # TODO: fix this somehow
-    # sf = configureEngine('stockfish', {'Threads': '10', 'Hash': '8192'})
     if position.is_game_over():
         return None
+    start = telemetry.clock()
+    if budget:
+        info = analysisCPAdaptive(position, sf, budget, game)
+    else:
+        info = sf.analyse(position, chess.engine.Limit(time=timeLimit), game=game)
+    telemetry.recordEngine('stockfish', sf.id.get('name', 'stockfish'), info, telemetry.clock() - start, position.fen())
+    return info
+
 
-    info = sf.analyse(position, chess.engine.Limit(time=timeLimit))
-    # sf.quit()
+class TimeBudget:
+    """
+    This class distributes the Stockfish time of a game or a whole PGN over its positions.
+    Positions where the evaluation is stable early don't use their share, so the volatile positions get more time.
+    """
+    def __init__(self, totalTime: float, positions: int, minTime: float = 0.1, maxFactor: float = 3, minDepth: int = 12, stableDepths: int = 4, stableCP: int = 15, forcedDepth: int = 8):
+        """
+        totalTime: float
+            The time in seconds for all positions
+        positions: int
+            The number of positions
+        minTime: float
+            The minimal time of a position and the maximal time for positions with only one legal move
+        maxFactor: float
+            A position gets at most this many times the average time of the remaining positions
+        minDepth: int
+            The analysis isn't stopped before this depth
+        stableDepths: int
+            The number of depths in a row with the same best move, after which the analysis is stopped
+        stableCP: int
+            The maximal change of the evaluation between these depths in centipawns
+        forcedDepth: int
+            The search depth for positions with only one legal move
+        """
+        self.remainingTime = totalTime
+        self.remainingPositions = positions
+        self.minTime = minTime
+        self.maxFactor = maxFactor
+        self.minDepth = minDepth
+        self.stableDepths = stableDepths
+        self.stableCP = stableCP
+        self.forcedDepth = forcedDepth
+
+
+    def limit(self) -> float:
+        """
+        This function returns the maximal time for the next position
+        """
+        if self.remainingTime <= 0:
+            return self.minTime
+        average = self.remainingTime / max(1, self.remainingPositions)
+        return max(self.minTime, min(average * self.maxFactor, self.remainingTime))
+
+
+    def spend(self, seconds: float):
+        """
+        This function subtracts the time used for a position from the budget
+        """
+        self.remainingTime -= seconds
+        self.remainingPositions = max(0, self.remainingPositions - 1)
+
+
+def analysisCPAdaptive(position: Board, sf: engine, budget: TimeBudget, game = None) -> dict:
+    """
+    This function analyses a position with Stockfish until the evaluation and best move are stable or the time from the budget is used up.
+    Forced moves aren't skipped, since the comment and evalDB need an evaluation of every position.
+    They only get a shallow search of forcedDepth, which stops after the minimal time of the budget.
+    position: Board
+        The position to analyse, the game must not be over
+    sf: engine
+        Stockfish as a configured chess engine
+    budget: TimeBudget
+        The budget of the game or PGN
+    game
+        The game of the position, Stockfish gets ucinewgame if it differs from the last analysis
+    return -> dict
+        The info of the last depth, like from sf.analyse
+    """
+    start = time.time()
+    if position.legal_moves.count() == 1:
+        info = sf.analyse(position, chess.engine.Limit(depth=budget.forcedDepth, time=budget.minTime), game=game)
+        budget.spend(time.time() - start)
+        return info
+
+    # A RestartingEngine is started again if it died, the analysis of the position is repeated then
+    retries = getattr(sf, 'retries', 0)
+    for attempt in range(retries + 1):
+        try:
+            info = searchUntilStable(position, sf, budget, game)
+            break
+        except chess.engine.EngineTerminatedError:
+            if attempt == retries:
+                raise
+    budget.spend(time.time() - start)
     return info
 
 
+def searchUntilStable(position: Board, sf: engine, budget: TimeBudget, game = None) -> dict:
+    """
+    This function runs the Stockfish search of analysisCPAdaptive until the best move and evaluation are stable or the time limit is reached
+    return -> dict
+        The info of the last depth
+    """
+    lastMove = None
+    lastScore = None
+    stable = 0
+    with sf.analysis(position, chess.engine.Limit(time=budget.limit()), game=game) as analysis:
+        for info in analysis:
+            if 'score' not in info or 'pv' not in info or info.get('lowerbound') or info.get('upperbound'):
+                continue
+            move = info['pv'][0]
+            score = info['score'].white().score(mate_score=10000)
+            if move == lastMove and abs(score - lastScore) <= budget.stableCP:
+                stable += 1
+            else:
+                stable = 0
+            lastMove = move
+            lastScore = score
+            if info.get('depth', 0) >= budget.minDepth and stable >= budget.stableDepths:
+                break
+        return dict(analysis.info)
+
+
 def analysisCPnWDL(position: Board, lc0: engine, nodes: int) -> tuple:
     """
     This function analyses a position both with LC0 and Stockfish. It returns the WDL and CP infos as tuple.
@@ -229,11 +1088,9 @@ def analysisCPnWDL(position: Board, lc0: engine, nodes: int) -> tuple:
     if position.is_game_over():
         return None
 
-    # Defining Stockfish here is not ideal, but it's the easiest way right now
-    sf = configureEngine('stockfish', {'Threads': '10', 'Hash': '8192'})
+    sf = engines.getEngine('stockfish')
     iLC0 = lc0.analyse(position, chess.engine.Limit(nodes=nodes))
     iSF = sf.analyse(position, chess.engine.Limit(time=4))
-    sf.quit()
     return (iLC0, iSF)
 
 
@@ -646,25 +1503,23 @@ def maiaMoves(positions: list, maiaFolder: str) -> dict:
         ret[pos] = list()
 
     for i in range(1, 10):
-        # starting the engine new each loop seems wasteful but it gets rid of a caching problem
-        # maia = configureEngine('/home/julian/lc0/build/release/lc0', {'UCI_ShowWDL': 'true'})
-        maia = configureEngine('/opt/homebrew/Cellar/lc0/0.30.0/bin/lc0', {'UCI_ShowWDL': 'true'})
+        # Every model gets its own engine, switching the weights of one engine gives a caching problem
         w = f'{maiaFolder}/maia-1{i}00.pb.gz'
-        maia.configure({'WeightsFile': w})
+        maia = engines.getEngine('maia', {'WeightsFile': w})
         moves = list()
         for pos in positions:
             board = Board(pos)
             info = maia.analyse(board, chess.engine.Limit(nodes=1))
             print(info)
             ret[pos].append(board.san(info['pv'][0]))
-        maia.quit()
+        # The models are only needed for these positions, keeping nine LC0 processes would waste the memory
+        engines.releaseEngine('maia', {'WeightsFile': w})
     return ret
 
 
 def commandLine():
     op = {'WeightsFile': '/home/julian/Desktop/largeNet', 'UCI_ShowWDL': 'true'}
-    leela = configureEngine('lc0', op)
-    sf = configureEngine('stockfish', {'Threads': '10', 'Hash': '8192'})
+    sfOp = {'Threads': '10', 'Hash': '8192'}
     
     parser = argparse.ArgumentParser(
             prog='Game analysis',
@@ -673,13 +1528,59 @@ def commandLine():
     parser.add_argument('-o', '--out-file', help="Path to the output PGN file")
     parser.add_argument('-t', '--time', default=4, help="Analysis time of Stockfish in seconds")
     parser.add_argument('-n', '--nodes', default=10000, help="Number of nodes LC0 analyses")
+    parser.add_argument('-w', '--writer', action='store_true', help=f"Send the database writes to the writer started with 'evalDB.py serve', to run several analyses in parallel. The shared key is read from {evalDB.WRITER_AUTHKEY_VARIABLE}")
+    parser.add_argument('-b', '--bloom', action='store_true', help="Skip database lookups of positions which are not in the Bloom filter of the database")
+    parser.add_argument('--workers', default=1, help="Number of engine pairs analysing games in parallel, the Stockfish threads and hash are split between them")
+    parser.add_argument('--dedup', action='store_true', help="Analyse every position which occurs in several games only once")
+    parser.add_argument('-c', '--concurrent', action='store_true', help="Run Stockfish and LC0 at the same time on every position")
+    parser.add_argument('-a', '--adaptive', action='store_true', help="Use the Stockfish time per position as budget, stop stable positions early and spend the rest on volatile ones")
+    parser.add_argument('--two-pass', action='store_true', help="Analyse all positions with a shallow search first and only the positions around large evaluation swings at full strength")
+    parser.add_argument('--backward', action='store_true', help="Analyse the positions of every game from the last to the first, so the engine hash of the later positions helps with the earlier ones")
+    parser.add_argument('--telemetry', help="Path to a JSONL file for the timing of every position, a summary is printed at the end")
 
     args = parser.parse_args()
-
-    analyseGames(args.input_filename, args.out_file, sf, leela, int(args.time), int(args.nodes))
-
-    sf.quit()
-    leela.quit()
+    if int(args.workers) > 1:
+        # The worker pool analyses whole games, these modes need all positions of the PGN in one process
+        for option, used in [('--dedup', args.dedup), ('--two-pass', args.two_pass), ('--concurrent', args.concurrent)]:
+            if used:
+                parser.error(f'{option} can\'t be combined with --workers')
+    # Each mode has its own analysis function, which only supports some of the other options
+    unsupported = [('--concurrent', args.concurrent, [('--bloom', args.bloom), ('--adaptive', args.adaptive), ('--backward', args.backward), ('--dedup', args.dedup), ('--two-pass', args.two_pass)]),
+                   ('--dedup', args.dedup, [('--two-pass', args.two_pass), ('--backward', args.backward)]),
+                   ('--two-pass', args.two_pass, [('--adaptive', args.adaptive), ('--backward', args.backward)])]
+    for mode, modeUsed, options in unsupported:
+        for option, used in options:
+            if modeUsed and used:
+                parser.error(f'{option} can\'t be combined with {mode}')
+    if args.writer and not os.environ.get(evalDB.WRITER_AUTHKEY_VARIABLE):
+        parser.error(f'--writer needs the shared key of the writer in {evalDB.WRITER_AUTHKEY_VARIABLE}')
+
+    if args.telemetry:
+        telemetry.useTelemetry(args.telemetry, append=False)
+
+    if int(args.workers) > 1:
+        analyseGamesParallel(args.input_filename, args.out_file, int(args.workers), sfOp, op, int(args.time), int(args.nodes), op['WeightsFile'], adaptive=args.adaptive, backward=args.backward, bloom=args.bloom)
+    elif args.concurrent:
+        if args.writer:
+            evalDB.useWriter()
+        asyncio.run(analyseGamesAsync(args.input_filename, args.out_file, sfOp, op, int(args.time), int(args.nodes), op['WeightsFile']))
+    else:
+        leela = engines.getEngine('lc0', op)
+        sf = engines.getEngine('stockfish', sfOp)
+
+        if args.writer:
+            evalDB.useWriter()
+        if args.bloom:
+            evalDB.useBloomFilter()
+
+        if args.dedup:
+            analyseGamesDeduplicated(args.input_filename, args.out_file, sf, leela, int(args.time), int(args.nodes), op['WeightsFile'], args.adaptive)
+        else:
+            analyseGames(args.input_filename, args.out_file, sf, leela, int(args.time), int(args.nodes), op['WeightsFile'], args.adaptive, args.two_pass, backward=args.backward)
+        print(f'Evaluation cache: {evalDB.cacheStats()}')
+
+    if args.telemetry:
+        telemetry.printSummary(telemetry.summarize(args.telemetry))
 
 
 if __name__ == '__main__':
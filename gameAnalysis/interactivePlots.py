@@ -2,6 +2,7 @@ import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import annotationReader
 from flask import Flask, render_template_string
 import plotly.graph_objects as go
 import plotly.express as px
@@ -17,44 +18,42 @@ app = Flask(__name__)
 def getAccuracyDistribution(paths: list) -> dict:
     accuracies = {'acc': list(), 'rating': list()}
     for pgnPath in paths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                if 'WhiteElo' in game.headers.keys() and 'BlackElo' in game.headers.keys():
-                    wRating = int(game.headers['WhiteElo'])
-                    bRating = int(game.headers['BlackElo'])
-                else:
+        # Only the comments are needed, so the games are scanned without building the game trees
+        for headers, annotations in annotationReader.readAnnotations(pgnPath):
+            if 'WhiteElo' in headers.keys() and 'BlackElo' in headers.keys():
+                wRating = int(headers['WhiteElo'])
+                bRating = int(headers['BlackElo'])
+            else:
+                continue
+            cpBefore = None
+            for hasComment, cp, color in zip(annotations['comment'], annotations['cp'], annotations['color']):
+                acc = None
+                if not hasComment:
+                    continue
+                cpAfter = None if math.isnan(cp) else int(cp)
+                if not cpBefore:
+                    cpBefore = cpAfter
                     continue
-                node = game
-                cpBefore = None
-                while not node.is_end():
-                    node = node.variations[0]
-                    acc = None
-                    if not functions.readComment(node, True, True):
-                        continue
-                    cpAfter = functions.readComment(node, True, True)[1]
-                    if not cpBefore:
-                        cpBefore = cpAfter
-                        continue
-                    if abs(cpBefore) > 5000 and abs(cpAfter) > 5000 and cpBefore*cpAfter > 0:
-                        cpBefore = cpAfter
-                        continue
-                    if node.turn():
-                        wpB = functions.winP(cpBefore * -1)
-                        wpA = functions.winP(cpAfter * -1)
-                        acc = min(100, functions.accuracy(wpB, wpA))
-                        if acc < 0:
-                            acc = 1
-                        accuracies['acc'].append(int(acc))
-                        accuracies['rating'].append(bRating)
-                    else:
-                        wpB = functions.winP(cpBefore)
-                        wpA = functions.winP(cpAfter)
-                        acc = min(100, functions.accuracy(wpB, wpA))
-                        if acc < 0:
-                            acc = 1
-                        accuracies['acc'].append(int(acc))
-                        accuracies['rating'].append(wRating)
+                if abs(cpBefore) > 5000 and abs(cpAfter) > 5000 and cpBefore*cpAfter > 0:
                     cpBefore = cpAfter
+                    continue
+                if not color:
+                    wpB = functions.winP(cpBefore * -1)
+                    wpA = functions.winP(cpAfter * -1)
+                    acc = min(100, functions.accuracy(wpB, wpA))
+                    if acc < 0:
+                        acc = 1
+                    accuracies['acc'].append(int(acc))
+                    accuracies['rating'].append(bRating)
+                else:
+                    wpB = functions.winP(cpBefore)
+                    wpA = functions.winP(cpAfter)
+                    acc = min(100, functions.accuracy(wpB, wpA))
+                    if acc < 0:
+                        acc = 1
+                    accuracies['acc'].append(int(acc))
+                    accuracies['rating'].append(wRating)
+                cpBefore = cpAfter
     return accuracies
 
 
@@ -0,0 +1,141 @@
+import json
+import os
+import time
+
+
+# The telemetry file of this process, None if no telemetry is recorded
+_file = None
+_filePID = None
+_path = None
+
+clock = time.perf_counter
+
+
+def useTelemetry(path: str, append: bool = True):
+    """
+    This function starts recording telemetry events to a JSONL file.
+    Several processes can write to the same file, every event is one line.
+    path: str
+        The path to the JSONL file
+    append: bool
+        If this is false, the events of earlier runs in the file are removed
+    """
+    global _path, _file, _filePID
+    if not append:
+        open(path, 'w').close()
+    _path = path
+    _file = None
+    _filePID = None
+
+
+def currentPath() -> str:
+    """
+    This function returns the path of the telemetry file, None if telemetry is disabled
+    """
+    return _path
+
+
+def record(event: str, **fields):
+    """
+    This function writes one telemetry event, if telemetry is enabled
+    event: str
+        The type of the event ('engine', 'position', 'io' or 'game')
+    fields
+        The data of the event
+    """
+    global _file, _filePID
+    if _path is None:
+        return
+    if _file is None or _filePID != os.getpid():
+        # A forked worker opens the file itself, so the lines of the processes don't mix
+        _file = open(_path, 'a', buffering=1)
+        _filePID = os.getpid()
+    fields['event'] = event
+    fields['time'] = time.time()
+    fields['pid'] = _filePID
+    _file.write(json.dumps(fields) + '\n')
+
+
+def recordEngine(role: str, engineName: str, info: dict, seconds: float, fen: str = None):
+    """
+    This function records an engine analysis
+    role: str
+        'stockfish' or 'lc0', the time of the analysis counts for this engine in the summary
+    engineName: str
+        The name the engine reports
+    info: dict
+        The info returned by the analysis
+    seconds: float
+        The wall time of the analysis
+    fen: str
+        The analysed position
+    """
+    if _path is None or not info:
+        return
+    record('engine', role=role, engine=engineName, depth=info.get('depth'), nodes=info.get('nodes'), nps=info.get('nps'), seconds=seconds, position=fen)
+
+
+def summarize(path: str) -> dict:
+    """
+    This function summarizes a telemetry file
+    path: str
+        The path to the JSONL file
+    return -> dict
+        The number of positions, positions per hour, the cache hit rate, the mean queue wait
+        and the time spent in Stockfish, LC0 and I/O
+    """
+    positions = 0
+    cache = {'hit': 0, 'partial': 0, 'miss': 0}
+    seconds = {'stockfish': 0, 'lc0': 0, 'io': 0}
+    nps = {'stockfish': list(), 'lc0': list()}
+    queueWaits = {'game': list(), 'position': list()}
+    first = None
+    last = None
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            first = event['time'] if first is None else min(first, event['time'])
+            last = event['time'] if last is None else max(last, event['time'])
+            if event['event'] == 'position':
+                positions += 1
+                cache[event['cache']] += 1
+            elif event['event'] == 'engine':
+                seconds[event['role']] += event['seconds']
+                if event.get('nps'):
+                    nps[event['role']].append(event['nps'])
+            elif event['event'] == 'io':
+                seconds['io'] += event['seconds']
+            if event.get('queueWait') is not None and event['event'] in queueWaits:
+                queueWaits[event['event']].append(event['queueWait'])
+
+    wallTime = (last - first) if first is not None else 0
+    total = sum(seconds.values())
+    return {'positions': positions,
+            'positionsPerHour': positions / wallTime * 3600 if wallTime > 0 else None,
+            'cacheHitRate': cache['hit'] / positions if positions else None,
+            'cache': cache,
+            'seconds': seconds,
+            'timeSplit': {k: v / total for k, v in seconds.items()} if total > 0 else None,
+            'nps': {k: sum(v) / len(v) for k, v in nps.items() if v},
+            'queueWait': {k: sum(v) / len(v) for k, v in queueWaits.items() if v}}
+
+
+def printSummary(summary: dict):
+    """
+    This function prints the summary from summarize
+    """
+    print(f"{summary['positions']} positions", end='')
+    if summary['positionsPerHour']:
+        print(f", {summary['positionsPerHour']:.0f} positions/hour", end='')
+    if summary['cacheHitRate'] is not None:
+        print(f", cache hit rate {summary['cacheHitRate']:.1%} ({summary['cache']['partial']} partial hits)", end='')
+    print()
+    if summary['timeSplit']:
+        print('Time: ' + ', '.join(f'{k} {summary["seconds"][k]:.1f}s ({v:.1%})' for k, v in summary['timeSplit'].items()))
+    if summary['nps']:
+        print('Mean NPS: ' + ', '.join(f'{k} {v:.0f}' for k, v in summary['nps'].items()))
+    if summary['queueWait']:
+        print('Mean queue wait: ' + ', '.join(f'{k} {v:.2f}s' for k, v in summary['queueWait'].items()))
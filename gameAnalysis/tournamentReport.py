@@ -15,6 +15,8 @@ import collections
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import headerIndex
+import moveTable
 import plotting_helper
 
 import argparse
@@ -33,20 +35,19 @@ def getPlayers(pgnPath: str, whiteList: list = None) -> list:
         A list of the players' names
     """
     players = list()
-    with open(pgnPath, 'r') as pgn:
-        while (game := chess.pgn.read_game(pgn)):
-            if (w := game.headers["White"]) not in players:
-                if not whiteList:
+    for headers in headerIndex.readHeaders(pgnPath):
+        if (w := headers["White"]) not in players:
+            if not whiteList:
+                players.append(w)
+            else:
+                if w in whiteList:
                     players.append(w)
-                else:
-                    if w in whiteList:
-                        players.append(w)
-            if (b := game.headers["Black"]) not in players:
-                if not whiteList:
+        if (b := headers["Black"]) not in players:
+            if not whiteList:
+                players.append(b)
+            else:
+                if b in whiteList:
                     players.append(b)
-                else:
-                    if b in whiteList:
-                        players.append(b)
     return players
 
 
@@ -56,14 +57,13 @@ def getNumberOfGames(pgnPaths: list, whiteList: list = None) -> dict:
     """
     games = dict()
     for pgnPath in pgnPaths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                for player in [game.headers["White"], game.headers["Black"]]:
-                    if (whiteList is None) or (player in whiteList):
-                        if player in games.keys():
-                            games[player] += 1
-                        else:
-                            games[player] = 1
+        for headers in headerIndex.readHeaders(pgnPath):
+            for player in [headers["White"], headers["Black"]]:
+                if (whiteList is None) or (player in whiteList):
+                    if player in games.keys():
+                        games[player] += 1
+                    else:
+                        games[player] = 1
     return games
 
 
@@ -74,48 +74,47 @@ def getMoveData(pgnPaths: list) -> pd.DataFrame:
         A dataframe containing various fields where each contains a list with the data after each move
     """
     data = {'player': list(), 'rating': list(), 'acc': list(), 'sharp': list()}
-    for pgnPath in pgnPaths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                if 'WhiteElo' in game.headers.keys() and 'BlackElo' in game.headers.keys():
-                    # TODO: add option to ignore the ratings
-                    wRating = int(game.headers['WhiteElo'])
-                    bRating = int(game.headers['BlackElo'])
-                else:
-                    continue
-                white = game.headers['White']
-                black = game.headers['Black']
-                
-                node = game
-                cpB = None
-                
-                while not node.is_end():
-                    if functions.readComment(node, True, True):
-                        sharp = functions.sharpnessLC0(functions.readComment(node, True, True)[0])
-                    node = node.variations[0]
-                    if not functions.readComment(node, True, True):
-                        continue
-                    cpA = functions.readComment(node, True, True)[1]
-                    if cpB is None:
-                        cpB = cpA
-                        continue
+    # The PGNs are only parsed the first time, afterwards the cached move tables are used
+    for headers, moves in moveTable.iterGames(moveTable.loadMoveTables(pgnPaths)):
+        if 'WhiteElo' in headers.keys() and 'BlackElo' in headers.keys():
+            # TODO: add option to ignore the ratings
+            wRating = int(headers['WhiteElo'])
+            bRating = int(headers['BlackElo'])
+        else:
+            continue
+        white = headers['White']
+        black = headers['Black']
+        
+        cpB = None
+        lastMove = None
+        
+        for move in moves:
+            if lastMove is not None and lastMove['Comment']:
+                sharp = functions.sharpnessLC0([lastMove['W'], lastMove['D'], lastMove['L']])
+            lastMove = move
+            if not move['Comment']:
+                continue
+            cpA = move['CP']
+            if cpB is None:
+                cpB = cpA
+                continue
 
-                    if node.turn():
-                        wpB = functions.winP(cpB * -1)
-                        wpA = functions.winP(cpA * -1)
-                        data['player'].append(black)
-                        data['rating'].append(bRating)
-                    else:
-                        wpB = functions.winP(cpB)
-                        wpA = functions.winP(cpA)
-                        data['player'].append(white)
-                        data['rating'].append(wRating)
+            if not move['Color']:
+                wpB = functions.winP(cpB * -1)
+                wpA = functions.winP(cpA * -1)
+                data['player'].append(black)
+                data['rating'].append(bRating)
+            else:
+                wpB = functions.winP(cpB)
+                wpA = functions.winP(cpA)
+                data['player'].append(white)
+                data['rating'].append(wRating)
 
-                    acc = min(100, functions.accuracy(wpB, wpA))
-                    data['acc'].append(round(acc))
-                    data['sharp'].append(sharp)
+            acc = min(100, functions.accuracy(wpB, wpA))
+            data['acc'].append(round(acc))
+            data['sharp'].append(sharp)
 
-                    cpB = cpA
+            cpB = cpA
     df = pd.DataFrame(data)
     return df
 
@@ -0,0 +1,387 @@
+import sqlite3
+import os
+import socket
+import threading
+import queue
+import time
+import logging
+import argparse
+import json
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from chess import Board, Move
+from chess import engine
+from tqdm import tqdm
+import evalDB
+import engines
+import analysis
+
+
+QUEUE_PATH = '../out/workQueue.db'
+# Only local workers by default, workers on other machines need --host with the address of the network interface
+QUEUE_ADDRESS = ('127.0.0.1', 6002)
+# The environment variable with the shared key of the coordinator and the workers, if --authkey isn't given
+AUTHKEY_VARIABLE = 'WORK_QUEUE_AUTHKEY'
+
+
+class JobQueue:
+    """
+    This class stores the positions which still have to be analysed in a SQLite database.
+    A worker leases some positions and has to send the results before the lease expires, otherwise the positions are queued again.
+    """
+    def __init__(self, path: str = QUEUE_PATH, leaseTime: float = 600):
+        """
+        path: str
+            Path to the SQLite database of the queue
+        leaseTime: float
+            The time in seconds a worker has to analyse the positions it leased
+        """
+        self.leaseTime = leaseTime
+        # The client threads of the coordinator share the connection, the lock serialises them
+        self.lock = threading.RLock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('CREATE TABLE IF NOT EXISTS jobs (position TEXT PRIMARY KEY, fen TEXT, moves TEXT, sf INTEGER, lc0 INTEGER, state TEXT, worker TEXT, expires REAL)')
+        # Queues of older versions only have the FEN of the position
+        if 'moves' not in [column[1] for column in self.con.execute('PRAGMA table_info(jobs)')]:
+            self.con.execute('ALTER TABLE jobs ADD COLUMN moves TEXT')
+        self.con.execute('CREATE INDEX IF NOT EXISTS jobState ON jobs (state)')
+        # Leases of an earlier coordinator can't be completed anymore
+        self.con.execute("UPDATE jobs SET state = 'queued', worker = NULL, expires = NULL WHERE state = 'leased'")
+        self.con.commit()
+
+
+    def add(self, jobs: list):
+        """
+        This function queues positions. A position which is already in the queue is queued again with the new engines.
+        jobs: list
+            Tuples of the position (functions.modifyFEN), the FEN of the game start, the UCI moves leading to the position
+            separated by spaces and if Stockfish and LC0 have to analyse it
+        """
+        with self.lock:
+            self.con.executemany("INSERT INTO jobs (position, fen, moves, sf, lc0, state) VALUES (?, ?, ?, ?, ?, 'queued') "
+                                 "ON CONFLICT(position) DO UPDATE SET fen = excluded.fen, moves = excluded.moves, sf = excluded.sf, lc0 = excluded.lc0, state = 'queued', worker = NULL, expires = NULL",
+                                 [(position, fen, moves, int(sf), int(lc0)) for position, fen, moves, sf, lc0 in jobs])
+            self.con.commit()
+
+
+    def lease(self, n: int, worker: str) -> list:
+        """
+        This function leases up to n queued positions to a worker. Expired leases are queued again first,
+        so the positions of a crashed worker are given to the next worker asking for positions
+        return -> list
+            Tuples of the position, the FEN of the game start, the moves and if Stockfish and LC0 have to analyse it
+        """
+        with self.lock:
+            if requeued := self.requeueExpired():
+                logging.warning(f'{requeued} leases expired, the positions are queued again')
+            rows = self.con.execute("SELECT position, fen, moves, sf, lc0 FROM jobs WHERE state = 'queued' LIMIT ?", (n,)).fetchall()
+            expires = time.time() + self.leaseTime
+            self.con.executemany("UPDATE jobs SET state = 'leased', worker = ?, expires = ? WHERE position = ?",
+                                 [(worker, expires, row[0]) for row in rows])
+            self.con.commit()
+        return [(position, fen, moves or '', bool(sf), bool(lc0)) for position, fen, moves, sf, lc0 in rows]
+
+
+    def complete(self, position: str) -> bool:
+        """
+        This function marks a position as analysed
+        return -> bool
+            False if the position was already analysed (i.e. by a worker whose lease expired)
+        """
+        with self.lock:
+            cur = self.con.execute("UPDATE jobs SET state = 'done', worker = NULL, expires = NULL WHERE position = ? AND state != 'done'", (position,))
+            self.con.commit()
+        return cur.rowcount > 0
+
+
+    def release(self, worker: str) -> int:
+        """
+        This function queues the positions of a worker again, i.e. if the worker disconnected
+        return -> int
+            The number of positions queued again
+        """
+        with self.lock:
+            cur = self.con.execute("UPDATE jobs SET state = 'queued', worker = NULL, expires = NULL WHERE state = 'leased' AND worker = ?", (worker,))
+            self.con.commit()
+        return cur.rowcount
+
+
+    def requeueExpired(self) -> int:
+        """
+        This function queues the positions whose lease expired again
+        return -> int
+            The number of positions queued again
+        """
+        with self.lock:
+            cur = self.con.execute("UPDATE jobs SET state = 'queued', worker = NULL, expires = NULL WHERE state = 'leased' AND expires < ?", (time.time(),))
+            self.con.commit()
+        return cur.rowcount
+
+
+    def remaining(self) -> int:
+        """
+        This function returns the number of positions which aren't analysed yet
+        """
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM jobs WHERE state != 'done'").fetchone()[0]
+
+
+    def clear(self):
+        with self.lock:
+            self.con.execute('DELETE FROM jobs')
+            self.con.commit()
+
+
+    def close(self):
+        self.con.close()
+
+
+def sendMessage(conn, message):
+    """
+    This function sends a message as JSON. Connection.send would pickle it and unpickling a message from the network can run any code
+    """
+    conn.send_bytes(json.dumps(message).encode())
+
+
+def receiveMessage(conn):
+    return json.loads(conn.recv_bytes())
+
+
+def encodeInfo(info: dict) -> dict:
+    """
+    This function turns the parts of an engine info which are saved in evalDB into a dictionary which can be sent as JSON
+    return -> dict
+        The depth, the nodes, the PV as UCI moves and the score and WDL with the side to move
+    """
+    if not info:
+        return None
+    encoded = {'depth': info.get('depth', 0), 'nodes': info.get('nodes', 0)}
+    if 'pv' in info:
+        encoded['pv'] = [move.uci() for move in info['pv']]
+    if 'score' in info:
+        score = info['score']
+        encoded['score'] = {'turn': score.turn, 'cp': score.relative.score(), 'mate': score.relative.mate()}
+    if 'wdl' in info:
+        wdl = info['wdl']
+        encoded['wdl'] = {'turn': wdl.turn, 'wdl': list(wdl.relative)}
+    return encoded
+
+
+def decodeInfo(encoded: dict) -> dict:
+    """
+    This function makes an engine info from the dictionary of encodeInfo
+    """
+    if not encoded:
+        return None
+    info = {'depth': int(encoded['depth']), 'nodes': int(encoded['nodes'])}
+    if 'pv' in encoded:
+        info['pv'] = [Move.from_uci(move) for move in encoded['pv']]
+    if 'score' in encoded:
+        score = encoded['score']
+        relative = engine.Mate(int(score['mate'])) if score['mate'] is not None else engine.Cp(int(score['cp']))
+        info['score'] = engine.PovScore(relative, bool(score['turn']))
+    if 'wdl' in encoded:
+        w, d, l = (int(x) for x in encoded['wdl']['wdl'])
+        info['wdl'] = engine.PovWdl(engine.Wdl(w, d, l), bool(encoded['wdl']['turn']))
+    return info
+
+
+def serveClient(conn, jobs: JobQueue, results: queue.Queue, settings: dict):
+    """
+    This function answers the requests of one worker until it disconnects. The messages are JSON lists (see sendMessage).
+    ['lease', n, worker] is answered with the leased positions and the analysis settings, or None if everything is analysed.
+    ['result', position, infoSF, infoLC0, sfName, lc0Name] is passed to the coordinator, which saves it in evalDB.
+    """
+    worker = None
+    with conn:
+        while True:
+            try:
+                message = receiveMessage(conn)
+            except (EOFError, OSError):
+                break
+            except ValueError:
+                message = None
+            if not isinstance(message, list) or not message:
+                logging.warning(f'{worker} sent an invalid message')
+                break
+            if message[0] == 'lease':
+                _, n, worker = message
+                if jobs.remaining() == 0:
+                    sendMessage(conn, None)
+                    break
+                sendMessage(conn, {'jobs': jobs.lease(int(n), str(worker)), **settings})
+            elif message[0] == 'result':
+                _, posDB, iSF, iLC0, sfName, lc0Name = message
+                try:
+                    results.put((posDB, decodeInfo(iSF), decodeInfo(iLC0), str(sfName), str(lc0Name)))
+                except (KeyError, TypeError, ValueError):
+                    logging.warning(f'{worker} sent an invalid result for {posDB}')
+    if worker is not None and (released := jobs.release(worker)):
+        logging.warning(f'{worker} disconnected, {released} positions are queued again')
+
+
+def acceptWorkers(listener: Listener, jobs: JobQueue, results: queue.Queue, settings: dict):
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, ConnectionError):
+            # A worker with the wrong key mustn't stop the coordinator from accepting the others
+            continue
+        except OSError:
+            # The listener was closed by the coordinator
+            return
+        threading.Thread(target=serveClient, args=(conn, jobs, results, settings), daemon=True).start()
+
+
+def serveQueue(pgnPaths: list, outfile: str, timeLimit: int, nodeLimit: int, authkey: bytes, network: str = '', address: tuple = QUEUE_ADDRESS, leaseTime: float = 600, queuePath: str = QUEUE_PATH) -> dict:
+    """
+    This function coordinates the analysis of one or more PGNs by workers on this or other machines.
+    Every unique position which evalDB can't answer is queued, the workers lease positions and send back the engine analysis.
+    Only this process writes to evalDB. The annotated games are written once all positions are analysed.
+    pgnPaths: list
+        Paths to the PGN files
+    outfile: str
+        The path to the output PGN file with the games of all PGNs
+    timeLimit: int
+        Time limit for the Stockfish analysis
+    nodeLimit: int
+        Node limit for the LC0 analysis
+    authkey: bytes
+        The key the workers need to connect
+    network: str
+        The network used by LC0, it is stored with the evaluations
+    address: tuple
+        The address the workers connect to
+    leaseTime: float
+        The time in seconds a worker has for the positions it leased before they are given to other workers
+    queuePath: str
+        Path to the SQLite database of the queue
+    return -> dict
+        The number of unique positions and of positions analysed by the workers
+    """
+    games = list()
+    positions = dict()
+    keys = dict()
+    for pgnPath in pgnPaths:
+        plan = analysis.planAnalysis(pgnPath)
+        for posDB, (i, ply) in plan['origins'].items():
+            # The workers analyse the position with the moves of the first game reaching it
+            positions.setdefault(posDB, (len(games) + i, ply))
+            keys.setdefault(posDB, plan['keys'][posDB])
+        games += plan['games']
+    cached = evalDB.getEvals(list(positions.keys()), list(keys.values()))
+
+    comments = dict()
+    todo = list()
+    for posDB, (i, ply) in positions.items():
+        board = analysis.replayGame(games[i], ply)
+        needsSF, needsLC0 = analysis.missingAnalysis(board, posDB, cached, nodeLimit, network, keys[posDB])
+        if needsSF or needsLC0:
+            todo.append((posDB, board.root().fen(), ' '.join(move.uci() for move in board.move_stack), needsSF, needsLC0))
+        else:
+            comments[posDB] = analysis.saveAnalysis(posDB, cached, None, None, '', '', nodeLimit, network, keys[posDB])
+
+    jobs = JobQueue(queuePath, leaseTime)
+    # Positions of an earlier run which aren't in these PGNs would keep the workers busy
+    jobs.clear()
+    jobs.add(todo)
+    print(f'{len(positions)} unique positions, {len(todo)} have to be analysed')
+
+    results = queue.Queue()
+    settings = {'timeLimit': timeLimit, 'nodeLimit': nodeLimit, 'network': network}
+    listener = Listener(address, authkey=authkey)
+    threading.Thread(target=acceptWorkers, args=(listener, jobs, results, settings), daemon=True).start()
+    print(f'Waiting for workers on {listener.address[0]}:{listener.address[1]}')
+
+    with tqdm(total=len(todo), desc='Positions') as progress:
+        while jobs.remaining() > 0:
+            try:
+                posDB, iSF, iLC0, sfName, lc0Name = results.get(timeout=min(leaseTime, 10))
+            except queue.Empty:
+                if requeued := jobs.requeueExpired():
+                    logging.warning(f'{requeued} leases expired, the positions are queued again')
+                continue
+            # The sqlite connection of evalDB belongs to this thread, so the results are saved here
+            if jobs.complete(posDB):
+                comments[posDB] = analysis.saveAnalysis(posDB, cached, iSF, iLC0, sfName, lc0Name, nodeLimit, network, keys.get(posDB))
+                progress.update()
+    # The queue stays open, so workers which still ask for positions are told that the analysis is finished
+    listener.close()
+
+    analysis.writeAnnotatedGames(games, comments, outfile)
+    return {'uniquePositions': len(positions), 'analysedPositions': len(todo)}
+
+
+def runWorker(address: tuple, authkey: bytes, sfName: str = 'stockfish', lc0Name: str = 'lc0', batchSize: int = 4, wait: float = 5) -> int:
+    """
+    This function analyses positions from the coordinator started with serveQueue until all positions are analysed.
+    authkey: bytes
+        The key of the coordinator
+    sfName, lc0Name: str
+        The profiles in engines.PROFILES (or the commands) of the local engines
+    batchSize: int
+        The number of positions leased at once
+    wait: float
+        The time in seconds to wait before asking again, if all positions are leased by other workers
+    return -> int
+        The number of analysed positions
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    analysed = 0
+    with Client(address, authkey=authkey) as conn:
+        while True:
+            try:
+                sendMessage(conn, ['lease', batchSize, worker])
+                reply = receiveMessage(conn)
+            except (EOFError, OSError):
+                # The coordinator finished or stopped
+                break
+            if reply is None:
+                break
+            if not reply['jobs']:
+                time.sleep(wait)
+                continue
+            for posDB, fen, moves, needsSF, needsLC0 in reply['jobs']:
+                board = Board(fen)
+                # With the moves the engines see the history of the position, which matters for repetitions
+                for move in moves.split():
+                    board.push_uci(move)
+                sf = engines.getEngine(sfName) if needsSF else None
+                lc0 = engines.getEngine(lc0Name) if needsLC0 else None
+                iSF = analysis.analysisCP(board, sf, reply['timeLimit']) if needsSF else None
+                iLC0 = analysis.analysisWDL(board, lc0, reply['nodeLimit']) if needsLC0 else None
+                sendMessage(conn, ['result', posDB, encodeInfo(iSF), encodeInfo(iLC0), sf.id.get('name', 'stockfish') if sf else '', lc0.id.get('name', 'lc0') if lc0 else ''])
+                analysed += 1
+    return analysed
+
+
+def commandLine():
+    parser = argparse.ArgumentParser(
+            prog='Work queue',
+            description='This program distributes the analysis of PGN files to workers on several machines. The coordinator writes the evaluations to evalDB and the annotated games to the output file')
+    parser.add_argument('command', choices=['serve', 'work'], help="serve: queue the positions of the PGN files and wait for workers, work: analyse positions of a coordinator")
+    parser.add_argument('input_filenames', nargs='*', help="Paths to the PGN files to analyse (serve)")
+    parser.add_argument('-o', '--out-file', help="Path to the output PGN file (serve)")
+    parser.add_argument('-t', '--time', default=4, help="Analysis time of Stockfish in seconds (serve)")
+    parser.add_argument('-n', '--nodes', default=10000, help="Number of nodes LC0 analyses (serve)")
+    parser.add_argument('-l', '--lease', default=600, help="Time in seconds a worker has for its positions before they are queued again (serve)")
+    parser.add_argument('--host', default=QUEUE_ADDRESS[0], help="Address of the coordinator, the coordinator only accepts workers on other machines if this isn't a local address")
+    parser.add_argument('-p', '--port', default=QUEUE_ADDRESS[1], help="Port of the coordinator")
+    parser.add_argument('-b', '--batch', default=4, help="Number of positions a worker leases at once (work)")
+    parser.add_argument('-k', '--authkey', default=os.environ.get(AUTHKEY_VARIABLE), help=f"Shared key of the coordinator and the workers, the default is the environment variable {AUTHKEY_VARIABLE}")
+
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error(f'the coordinator and the workers need a shared key, use --authkey or set {AUTHKEY_VARIABLE}')
+    address = (args.host, int(args.port))
+    authkey = args.authkey.encode()
+    if args.command == 'serve':
+        stats = serveQueue(args.input_filenames, args.out_file, int(args.time), int(args.nodes), authkey, engines.PROFILES['lc0'][1]['WeightsFile'], address, leaseTime=float(args.lease))
+        print(f"{stats['analysedPositions']} of {stats['uniquePositions']} positions analysed by the workers")
+    elif args.command == 'work':
+        print(f'{runWorker(address, authkey, batchSize=int(args.batch))} positions analysed')
+
+
+if __name__ == '__main__':
+    commandLine()
@@ -9,6 +9,7 @@ import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import moveTable
 import plotting_helper
 import numpy as np
 
@@ -35,68 +36,61 @@ def getMoveData(pgnPaths: list, lichessAnalysis: bool = False, startEval: int =
     for c in columns:
         data[c] = list()
 
-    for pgnPath in pgnPaths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                if "WhiteElo" not in game.headers or "BlackElo" not in game.headers:
-                    if "White" in game.headers and "Black" in game.headers and "Date" in game.headers:
-                        print(f'No Elo in {game.headers["White"]}-{game.headers["Black"]}, game.headers["Date"]')
-                    else:
-                        print('No names')
-                    continue
-
-                ply = 0
-                wElo = int(game.headers["WhiteElo"])
-                bElo = int(game.headers["BlackElo"])
-                result = game.headers["Result"]
-
-                if result not in ["1-0", "1/2-1/2", "0-1"]:
-                    print(f"Result not found: {result}")
-                    continue
-
-                evalBefore = startEval
-                wdlBefore = startWDL
-
-                node = game
-                while not node.is_end():
-                    board = node.board()
-                    node = node.variations[0]
-                    ply += 1
-                    if node.comment:
-                        if lichessAnalysis:
-                            if not node.eval():
-                                print(f'No evaluation found in {game.headers["White"]}-{game.headers["Black"]}, {game.headers["Date"]} on ply {ply}')
-                                break
-                            cp = int(node.eval().white().score(mate_score=10000))
-                            wdl = [0, 0, 0]
-                        else:
-                            wdl, cp = functions.readComment(node, True, True)
-                            if wdl is None:
-                                wdl = [0, 0, 0]
-                            if cp is None:
-                                print(f'No evaluation found in {game.headers["White"]}-{game.headers["Black"]}, {game.headers["Date"]} on ply {ply}')
-                        move = node.move
-                        data["GameID"].append(gameID)
-                        data["Color"].append(board.turn)
-                        data["WhiteElo"].append(wElo)
-                        data["BlackElo"].append(bElo)
-                        data["Result"].append(result)
-                        data["Position"].append(board.fen())
-                        data["EvalBefore"].append(evalBefore)
-                        data["WinPBefore"].append(wdlBefore[0])
-                        data["DrawPBefore"].append(wdlBefore[1])
-                        data["LossPBefore"].append(wdlBefore[2])
-                        data["EvalAfter"].append(cp)
-                        data["WinPAfter"].append(wdl[0])
-                        data["DrawPAfter"].append(wdl[1])
-                        data["LossPAfter"].append(wdl[2])
-                        data["Move"].append(move.uci())
-                        data["Ply"].append(ply)
-                        evalBefore = cp
-                        wdlBefore = wdl
-                    elif not node.is_end():
-                        print(f'No comment found in {game.headers["White"]}-{game.headers["Black"]}, {game.headers["Date"]} on ply {ply}')
-                gameID += 1
+    # The PGNs are only parsed the first time, afterwards the cached move tables are used
+    for headers, moves in moveTable.iterGames(moveTable.loadMoveTables(pgnPaths)):
+        if "WhiteElo" not in headers or "BlackElo" not in headers:
+            if "White" in headers and "Black" in headers and "Date" in headers:
+                print(f'No Elo in {headers["White"]}-{headers["Black"]}, headers["Date"]')
+            else:
+                print('No names')
+            continue
+
+        wElo = int(headers["WhiteElo"])
+        bElo = int(headers["BlackElo"])
+        result = headers["Result"]
+
+        if result not in ["1-0", "1/2-1/2", "0-1"]:
+            print(f"Result not found: {result}")
+            continue
+
+        evalBefore = startEval
+        wdlBefore = startWDL
+
+        for move in moves:
+            ply = move["Ply"]
+            if move["Comment"]:
+                if lichessAnalysis:
+                    cp = moveTable.evalScore(move, 10000)
+                    if cp is None:
+                        print(f'No evaluation found in {headers["White"]}-{headers["Black"]}, {headers["Date"]} on ply {ply}')
+                        break
+                    wdl = [0, 0, 0]
+                else:
+                    cp = move["CP"]
+                    wdl = [move["W"], move["D"], move["L"]] if move["W"] is not None else [0, 0, 0]
+                    if cp is None:
+                        print(f'No evaluation found in {headers["White"]}-{headers["Black"]}, {headers["Date"]} on ply {ply}')
+                data["GameID"].append(gameID)
+                data["Color"].append(move["Color"])
+                data["WhiteElo"].append(wElo)
+                data["BlackElo"].append(bElo)
+                data["Result"].append(result)
+                data["Position"].append(move["Position"])
+                data["EvalBefore"].append(evalBefore)
+                data["WinPBefore"].append(wdlBefore[0])
+                data["DrawPBefore"].append(wdlBefore[1])
+                data["LossPBefore"].append(wdlBefore[2])
+                data["EvalAfter"].append(cp)
+                data["WinPAfter"].append(wdl[0])
+                data["DrawPAfter"].append(wdl[1])
+                data["LossPAfter"].append(wdl[2])
+                data["Move"].append(move["Move"])
+                data["Ply"].append(ply)
+                evalBefore = cp
+                wdlBefore = wdl
+            elif ply < len(moves):
+                print(f'No comment found in {headers["White"]}-{headers["Black"]}, {headers["Date"]} on ply {ply}')
+        gameID += 1
     df = pl.DataFrame(data)
     return df
 
@@ -6,6 +6,8 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
 import evalDB
+import engines
+import moveTable
 import math
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
@@ -27,94 +29,84 @@ def readMoveData(pgnPaths: list, is_chess960: bool = False, lichessAnalysis: boo
     gameID = 0
     for c in columns:
         data[c] = list()
-    for pgnPath in pgnPaths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                if "WhiteElo" not in game.headers.keys() or "BlackElo" not in game.headers.keys():
-                    print("No Elo")
-                    continue
-                ply = 1
-                wElo = int(game.headers["WhiteElo"])
-                bElo = int(game.headers["BlackElo"])
-                result = game.headers["Result"]
-
-                if is_chess960:
-                    # analysing the starting position if it is a 960 game
-                    board = game.board()
-                    pos = board.fen()
-                    posDB = functions.modifyFEN(pos)
-                    evalBefore = None
-                    wdlBefore = None
-                    
-                    if evalDB.contains(posDB):
-                        evalDict = evalDB.getEval(posDB)
-                        wdl = evalDict['wdl']
-                        cp = evalDict['cp']
-                        if evalDict['depth'] > 0 and evalDict['nodes'] > 0:
-                            evalBefore = cp
-                            wdlBefore = wdl
-                        else:
-                            # TODO!
-                            print('Not found in cache')
-                    if not evalDB.contains(posDB) or evalBefore is None or wdlBefore is None or type(evalBefore) is not int:
-                        # TODO!
-                        print('Analysing position...')
-                        op = {'WeightsFile': '/home/julian/Desktop/largeNet', 'UCI_ShowWDL': 'true'}
-                        leela = functions.configureEngine('lc0', op)
-                        sf = functions.configureEngine('stockfish', {'Threads': '10', 'Hash': '8192'})
-                        LC0Info = leela.analyse(board, chess.engine.Limit(nodes=10000))
-                        wdl = list(chess.engine.PovWdl.white(LC0Info['wdl']))
-                        sfInfo = sf.analyse(board, chess.engine.Limit(time=4))
-                        cp = sfInfo['score'].white().score()
-                        print(cp)
-                        if evalDB.contains(posDB) or type(evalBefore) is not int:
-                            evalDB.update(posDB, nodes=10000, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=sfInfo['depth'])
-                        else:
-                            evalDB.insert(posDB, nodes=10000, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=sfInfo['depth'])
-                        sf.quit()
-                        leela.quit()
-
-                        evalBefore = cp
-                        wdlBefore = wdl
+    # The PGNs are only parsed the first time, afterwards the cached move tables are used
+    for headers, moves in moveTable.iterGames(moveTable.loadMoveTables(pgnPaths)):
+        if "WhiteElo" not in headers.keys() or "BlackElo" not in headers.keys():
+            print("No Elo")
+            continue
+        wElo = int(headers["WhiteElo"])
+        bElo = int(headers["BlackElo"])
+        result = headers["Result"]
+
+        if is_chess960:
+            # analysing the starting position if it is a 960 game, a game without moves only has it in its FEN tag
+            board = chess.Board(moves[0]["Position"] if moves else headers.get("FEN", chess.STARTING_FEN), chess960=True)
+            pos = board.fen()
+            posDB = functions.modifyFEN(pos)
+            evalBefore = None
+            wdlBefore = None
+            
+            if evalDB.contains(posDB):
+                evalDict = evalDB.getEval(posDB)
+                wdl = evalDict['wdl']
+                cp = evalDict['cp']
+                if evalDict['depth'] > 0 and evalDict['nodes'] > 0:
+                    evalBefore = cp
+                    wdlBefore = wdl
+                else:
+                    # TODO!
+                    print('Not found in cache')
+            if not evalDB.contains(posDB) or evalBefore is None or wdlBefore is None or type(evalBefore) is not int:
+                # TODO!
+                print('Analysing position...')
+                leela = engines.getEngine('lc0')
+                sf = engines.getEngine('stockfish')
+                LC0Info = leela.analyse(board, chess.engine.Limit(nodes=10000))
+                wdl = list(chess.engine.PovWdl.white(LC0Info['wdl']))
+                sfInfo = sf.analyse(board, chess.engine.Limit(time=4))
+                cp = sfInfo['score'].white().score()
+                print(cp)
+                if evalDB.contains(posDB) or type(evalBefore) is not int:
+                    evalDB.update(posDB, nodes=10000, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=sfInfo['depth'])
                 else:
-                    evalBefore = startEval
-                    wdlBefore = startWDL
+                    evalDB.insert(posDB, nodes=10000, cp=cp, w=wdl[0], d=wdl[1], l=wdl[2], depth=sfInfo['depth'])
 
-                node = game
-                while not node.is_end():
-                    board = node.board()
-                    node = node.variations[0]
-                    ply += 1
-                    if node.comment:
-                        if lichessAnalysis:
-                            if not node.eval():
-                                break
-                            cp = int(node.eval().white().score(mate_score=10000))
-                            wdl = [0, 0, 0]
-                        else:
-                            wdl, cp = functions.readComment(node, True, True)
-                            if wdl is None:
-                                wdl = [0, 0, 0]
-                        move = node.move
-                        data["GameID"].append(gameID)
-                        data["Color"].append(board.turn)
-                        data["WhiteElo"].append(wElo)
-                        data["BlackElo"].append(bElo)
-                        data["Result"].append(result)
-                        data["Position"].append(board.fen())
-                        data["EvalBefore"].append(evalBefore)
-                        data["WinPBefore"].append(wdlBefore[0])
-                        data["DrawPBefore"].append(wdlBefore[1])
-                        data["LossPBefore"].append(wdlBefore[2])
-                        data["EvalAfter"].append(cp)
-                        data["WinPAfter"].append(wdl[0])
-                        data["DrawPAfter"].append(wdl[1])
-                        data["LossPAfter"].append(wdl[2])
-                        data["Move"].append(move.uci())
-                        data["MoveNr"].append(ply//2)
-                        evalBefore = cp
-                        wdlBefore = wdl
-                gameID += 1
+                evalBefore = cp
+                wdlBefore = wdl
+        else:
+            evalBefore = startEval
+            wdlBefore = startWDL
+
+        for move in moves:
+            ply = move["Ply"] + 1
+            if move["Comment"]:
+                if lichessAnalysis:
+                    cp = moveTable.evalScore(move, 10000)
+                    if cp is None:
+                        break
+                    wdl = [0, 0, 0]
+                else:
+                    cp = move["CP"]
+                    wdl = [move["W"], move["D"], move["L"]] if move["W"] is not None else [0, 0, 0]
+                data["GameID"].append(gameID)
+                data["Color"].append(move["Color"])
+                data["WhiteElo"].append(wElo)
+                data["BlackElo"].append(bElo)
+                data["Result"].append(result)
+                data["Position"].append(move["Position"])
+                data["EvalBefore"].append(evalBefore)
+                data["WinPBefore"].append(wdlBefore[0])
+                data["DrawPBefore"].append(wdlBefore[1])
+                data["LossPBefore"].append(wdlBefore[2])
+                data["EvalAfter"].append(cp)
+                data["WinPAfter"].append(wdl[0])
+                data["DrawPAfter"].append(wdl[1])
+                data["LossPAfter"].append(wdl[2])
+                data["Move"].append(move["Move"])
+                data["MoveNr"].append(ply//2)
+                evalBefore = cp
+                wdlBefore = wdl
+        gameID += 1
     df = pd.DataFrame(data)
     return df
 
@@ -0,0 +1,68 @@
+import pandas as pd
+import moveTable
+import annotationReader
+
+# Increased when the columns change, so old indices are made again
+INDEX_VERSION = 2
+
+# The Seven Tag Roster with the values python-chess uses if a tag is missing
+DEFAULT_HEADERS = {'Event': '?', 'Site': '?', 'Date': '????.??.??', 'Round': '?', 'White': '?', 'Black': '?', 'Result': '*'}
+
+
+def scanHeaders(pgnPath: str):
+    """
+    This function reads the headers of the games in a PGN file without parsing the moves.
+    The games are split like by chess.pgn.read_headers (see annotationReader.splitGames), the tags up to the movetext are the headers.
+    pgnPath: str
+        The path to the PGN file
+    return
+        Yields the headers of every game as dictionary, like game.headers from python-chess.
+        'Offset' is the byte offset of the game in the file
+    """
+    with open(pgnPath, 'rb') as pgn:
+        for offset, lines in annotationReader.splitGames(pgn):
+            headers = {**DEFAULT_HEADERS, 'Offset': offset}
+            for line in lines:
+                if match := annotationReader.TAG_LINE_REGEX.match(line):
+                    headers[match.group(1).decode()] = annotationReader.unescapeTag(match.group(2).decode(errors='replace'))
+                elif not (line.isspace() or line.startswith(b'[') or line.startswith(b'%') or line.startswith(b';')):
+                    # The movetext starts
+                    break
+            yield headers
+
+
+def buildHeaderIndex(pgnPath: str) -> pd.DataFrame:
+    """
+    This function makes the header index of a PGN file, one row per game with a column for every tag and the byte offset ('Offset')
+    """
+    index = pd.DataFrame(list(scanHeaders(pgnPath)))
+    if not len(index):
+        return pd.DataFrame(columns=['Offset', *DEFAULT_HEADERS.keys()])
+    tags = [c for c in index.columns if c != 'Offset']
+    return index.astype({**{tag: 'string' for tag in tags}, 'Offset': 'int64'})
+
+
+def loadHeaderIndex(pgnPath: str, rebuild: bool = False) -> pd.DataFrame:
+    """
+    This function returns the header index of a PGN file (see buildHeaderIndex).
+    The index is cached next to the PGN ('{pgnPath}.headers.parquet') and made again when the PGN changes (see moveTable.loadCachedTable)
+    pgnPath: str
+        The path to the PGN file
+    rebuild: bool
+        If this is true, the headers are always scanned again
+    return -> pd.DataFrame
+        The header index
+    """
+    return moveTable.loadCachedTable(pgnPath, 'headers', lambda: buildHeaderIndex(pgnPath), INDEX_VERSION, rebuild)
+
+
+def readHeaders(pgnPath: str) -> list:
+    """
+    This function returns the headers of all games in a PGN file from its header index
+    return -> list
+        The headers of every game as dictionary, only with the tags the game has
+    """
+    index = loadHeaderIndex(pgnPath)
+    tags = [c for c in index.columns if c != 'Offset']
+    records = index[tags].astype(object).where(index[tags].notna(), None).to_dict('records')
+    return [{tag: value for tag, value in record.items() if value is not None} for record in records]
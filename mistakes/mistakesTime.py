@@ -6,6 +6,7 @@ import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import moveTable
 import plotting_helper
 
 
@@ -16,48 +17,48 @@ def extractMoveData(pgnPaths: list) -> pd.DataFrame:
     for key in keys:
         data[key] = list()
 
-    for pgnPath in pgnPaths:
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                elos = [int(game.headers['WhiteElo']), int(game.headers['BlackElo'])]
+    # The PGNs are only parsed the first time, afterwards the cached move tables are used
+    for headers, moves in moveTable.iterGames(moveTable.loadMoveTables(pgnPaths)):
+        elos = [int(headers['WhiteElo']), int(headers['BlackElo'])]
 
-                times = [None, None]
+        times = [None, None]
+        lastEval = None
+        lastScore = None
+        moveNr = 0
+
+        for move in moves:
+            color = move['Color']
+            if color:
+                cIndex = 0
+                moveNr += 1
+            else:
+                cIndex = 1
+            pov = 1 if color else -1
+
+            if lastScore is not None:
+                lastEval = int(lastScore * pov)
+            else:
                 lastEval = None
-                moveNr = 0
-
-                node = game
-                while not node.is_end():
-                    color = node.board().turn
-                    if color:
-                        cIndex = 0
-                        moveNr += 1
-                    else:
-                        cIndex = 1
-
-                    if node.eval() is not None:
-                        lastEval = int(node.eval().pov(color).score(mate_score=mate_score))
-                    else:
-                        lastEval = None
-
-                    node = node.variations[0]
-                    newTime = node.clock()
-                    if node.eval() is not None:
-                        newEval = int(node.eval().pov(color).score(mate_score=mate_score))
-                    else:
-                        newEval = None
-                    if newTime is None and moveNr > 1:
-                        # print('No Time')
-                        newTime = times[cIndex]
-                    if times[cIndex] is not None and lastEval is not None:
-                        newTime = int(newTime)
-                        data['Rating'].append(elos[cIndex])
-                        data['TimeBefore'].append(int(times[cIndex]))
-                        data['TimeAfter'].append(newTime)
-                        data['EvalBefore'].append(lastEval)
-                        data['EvalAfter'].append(newEval)
-                        data['MoveNr'].append(moveNr)
-
-                    times[cIndex] = newTime
+
+            newTime = move['Clock']
+            lastScore = moveTable.evalScore(move, mate_score)
+            if lastScore is not None:
+                newEval = int(lastScore * pov)
+            else:
+                newEval = None
+            if newTime is None and moveNr > 1:
+                # print('No Time')
+                newTime = times[cIndex]
+            if times[cIndex] is not None and lastEval is not None:
+                newTime = int(newTime)
+                data['Rating'].append(elos[cIndex])
+                data['TimeBefore'].append(int(times[cIndex]))
+                data['TimeAfter'].append(newTime)
+                data['EvalBefore'].append(lastEval)
+                data['EvalAfter'].append(newEval)
+                data['MoveNr'].append(moveNr)
+
+            times[cIndex] = newTime
                     
     df = pd.DataFrame(data)
     return df
@@ -0,0 +1,299 @@
+import os
+import io
+import hashlib
+import json
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import chess
+import chess.pgn
+import chess.polyglot
+import pandas as pd
+import annotationReader
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Without pyarrow the table is cached as pickle
+    pa = None
+
+# Increased when the columns change, so old caches are parsed again
+CACHE_VERSION = 2
+
+MOVE_COLUMNS = ['GameID', 'Ply', 'Position', 'Hash', 'Color', 'Move', 'Comment', 'CP', 'W', 'D', 'L', 'EvalCP', 'EvalMate', 'Clock']
+
+# Smaller PGNs are parsed in one process, starting the pool would take longer than parsing
+MIN_SHARD_BYTES = 4 << 20
+
+
+def parseMoveTable(pgnPath: str, workers: int = None) -> pd.DataFrame:
+    """
+    This function parses an annotated PGN file into a table with one row per move of the mainlines.
+    Large files are split into shards at game boundaries, which are parsed by a pool of processes.
+    pgnPath: str
+        The path to the PGN file
+    workers: int
+        The number of processes, the default is the number of cores
+    return -> pd.DataFrame
+        GameID: the number of the game in the file, Ply: starting with 1,
+        Position: the FEN before the move, Hash: the Zobrist hash of this position, Color: the side making the move (True for white), Move: UCI,
+        Comment: if the node after the move has a comment, CP, W, D, L: the evaluation in my comment format ('[w, d, l];cp'),
+        EvalCP, EvalMate: the [%eval ...] of Lichess from white's perspective, Clock: the [%clk ...] in seconds.
+        Missing values are NA. The headers of the games are added as columns.
+        A game without moves has one row with Ply 0, its start position and no move, so its headers and GameID are kept
+    """
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(pgnPath)
+    # More shards than processes, so a shard with long games doesn't keep the others waiting
+    shards = shardPGN(pgnPath, min(workers * 4, size // MIN_SHARD_BYTES + 1)) if workers > 1 else [(0, size)]
+    if len(shards) == 1:
+        results = [parseShard(pgnPath, 0, size)]
+    else:
+        with ProcessPoolExecutor(min(workers, len(shards))) as pool:
+            results = list(pool.map(parseShard, [pgnPath] * len(shards), *zip(*shards)))
+
+    # The GameIDs of a shard start at 0, they are shifted by the games of the shards before it
+    tables = list()
+    games = 0
+    for table, shardGames in results:
+        tables.append(table.assign(GameID=table['GameID'] + games))
+        games += shardGames
+    if len(tables) == 1:
+        return tables[0]
+    return pd.concat(tables, ignore_index=True)
+
+
+def shardPGN(pgnPath: str, shards: int) -> list:
+    """
+    This function splits a PGN file into byte ranges of about the same size, every range starts with the first tag of a game
+    return -> list
+        Tuples of the start and end of the ranges
+    """
+    size = os.path.getsize(pgnPath)
+    starts = [0]
+    with open(pgnPath, 'rb') as pgn:
+        for i in range(1, shards):
+            pgn.seek(max(size * i // shards, starts[-1]))
+            # The rest of the line the position is in
+            pgn.readline()
+            start = None
+            # A game starts with a tag line after an empty line, not necessarily with its Event tag
+            empty = False
+            while line := pgn.readline():
+                if empty and annotationReader.TAG_LINE_REGEX.match(line):
+                    start = pgn.tell() - len(line)
+                    break
+                empty = line.isspace()
+            if start is None:
+                break
+            if start > starts[-1]:
+                starts.append(start)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def parseShard(pgnPath: str, start: int, end: int) -> tuple:
+    """
+    This function parses the games in a byte range of a PGN file into a move table (see parseMoveTable)
+    return -> tuple
+        The table with GameIDs starting at 0 and the number of games in the range
+    """
+    with open(pgnPath, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+
+    data = {c: list() for c in MOVE_COLUMNS}
+    headers = list()
+    with io.StringIO(text) as pgn:
+        gameID = 0
+        while game := chess.pgn.read_game(pgn):
+            headers.append(dict(game.headers))
+            board = game.board()
+            ply = 0
+            node = game
+            while not node.is_end():
+                node = node.variations[0]
+                ply += 1
+                # Comments in other formats (i.e. from Lichess) give (None, None)
+                wdl, cp = annotationReader.parseComment(node.comment) if node.comment else (None, None)
+                evaluation = node.eval()
+                data['GameID'].append(gameID)
+                data['Ply'].append(ply)
+                data['Position'].append(board.fen())
+                data['Hash'].append(chess.polyglot.zobrist_hash(board))
+                data['Color'].append(board.turn)
+                data['Move'].append(node.move.uci())
+                data['Comment'].append(bool(node.comment))
+                data['CP'].append(cp)
+                for i, k in enumerate(['W', 'D', 'L']):
+                    data[k].append(wdl[i] if wdl else None)
+                data['EvalCP'].append(evaluation.white().score() if evaluation else None)
+                data['EvalMate'].append(evaluation.white().mate() if evaluation else None)
+                data['Clock'].append(node.clock())
+                board.push(node.move)
+            if ply == 0:
+                data['GameID'].append(gameID)
+                data['Ply'].append(0)
+                data['Position'].append(board.fen())
+                data['Hash'].append(chess.polyglot.zobrist_hash(board))
+                data['Color'].append(board.turn)
+                for k in ['Move', 'CP', 'W', 'D', 'L', 'EvalCP', 'EvalMate', 'Clock']:
+                    data[k].append(None)
+                data['Comment'].append(False)
+            gameID += 1
+
+    table = pd.DataFrame(data)
+    table = table.astype({'GameID': 'int64', 'Ply': 'int64', 'Hash': 'uint64', 'Color': 'bool', 'Comment': 'bool',
+                          'CP': 'Int64', 'W': 'Int64', 'D': 'Int64', 'L': 'Int64', 'EvalCP': 'Int64', 'EvalMate': 'Int64', 'Clock': 'float64'})
+    # The headers are stored with every move, the columns compress well since they repeat
+    headerTable = pd.DataFrame(headers, dtype='string')
+    if len(headerTable):
+        table = table.join(headerTable, on='GameID')
+    return (table, gameID)
+
+
+def fileKey(pgnPath: str, version: int = CACHE_VERSION) -> dict:
+    stat = os.stat(pgnPath)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'version': version}
+
+
+def fileHash(pgnPath: str) -> str:
+    """
+    This function returns the SHA-1 of the content of a file
+    """
+    sha = hashlib.sha1()
+    with open(pgnPath, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cacheFile(pgnPath: str, kind: str = 'moves') -> str:
+    return f'{pgnPath}.{kind}.parquet' if pa else f'{pgnPath}.{kind}.pkl'
+
+
+def readCacheKey(cachePath: str) -> dict:
+    """
+    This function returns the key of the PGN file a cache was made from, None if there is no cache
+    """
+    if not os.path.exists(cachePath):
+        return None
+    if pa:
+        metadata = pq.read_schema(cachePath).metadata or {}
+        return json.loads(metadata.get(b'moveTable', b'null'))
+    with open(cachePath, 'rb') as f:
+        return pickle.load(f)
+
+
+def readCache(cachePath: str) -> pd.DataFrame:
+    if pa:
+        return pq.read_table(cachePath).to_pandas()
+    with open(cachePath, 'rb') as f:
+        pickle.load(f)
+        return pickle.load(f)
+
+
+def writeCache(table: pd.DataFrame, cachePath: str, key: dict):
+    tmpPath = f'{cachePath}.tmp'
+    if pa:
+        arrowTable = pa.Table.from_pandas(table, preserve_index=False)
+        metadata = {**(arrowTable.schema.metadata or {}), b'moveTable': json.dumps(key).encode()}
+        pq.write_table(arrowTable.replace_schema_metadata(metadata), tmpPath)
+    else:
+        with open(tmpPath, 'wb') as f:
+            # The key is pickled first, so checking it doesn't need the whole table
+            pickle.dump(key, f)
+            pickle.dump(table, f)
+    # Replacing the file at once, so other processes never read a partial cache
+    os.replace(tmpPath, cachePath)
+
+
+def loadMoveTable(pgnPath: str, rebuild: bool = False, workers: int = None) -> pd.DataFrame:
+    """
+    This function returns the move table of a PGN file (see parseMoveTable).
+    The table is cached next to the PGN ('{pgnPath}.moves.parquet'). The cache is used as long as the size and modification time
+    of the PGN are the same. If they changed, the content hash decides if the PGN has to be parsed again.
+    pgnPath: str
+        The path to the PGN file
+    rebuild: bool
+        If this is true, the PGN is always parsed again
+    workers: int
+        The number of processes parsing the PGN, the default is the number of cores
+    return -> pd.DataFrame
+        The move table
+    """
+    return loadCachedTable(pgnPath, 'moves', lambda: parseMoveTable(pgnPath, workers), CACHE_VERSION, rebuild)
+
+
+def loadCachedTable(pgnPath: str, kind: str, parse, version: int, rebuild: bool = False) -> pd.DataFrame:
+    """
+    This function returns a table made from a PGN file and caches it next to the PGN ('{pgnPath}.{kind}.parquet').
+    The cache is used as long as the size and modification time of the PGN are the same.
+    If they changed, the content hash decides if the table has to be made again.
+    pgnPath: str
+        The path to the PGN file
+    kind: str
+        The name of the table in the file name of the cache
+    parse
+        Function without arguments which makes the table from the PGN
+    version: int
+        The version of the table, a cache with another version is made again
+    rebuild: bool
+        If this is true, the cache isn't used
+    return -> pd.DataFrame
+        The table
+    """
+    cachePath = cacheFile(pgnPath, kind)
+    key = fileKey(pgnPath, version)
+    cachedKey = None if rebuild else readCacheKey(cachePath)
+    if cachedKey and cachedKey['version'] == key['version']:
+        if cachedKey['size'] == key['size'] and cachedKey['mtime'] == key['mtime']:
+            return readCache(cachePath)
+        if cachedKey['size'] == key['size'] and cachedKey['sha1'] == (sha1 := fileHash(pgnPath)):
+            # The file was only touched or copied
+            table = readCache(cachePath)
+            writeCache(table, cachePath, {**key, 'sha1': sha1})
+            return table
+
+    table = parse()
+    writeCache(table, cachePath, {**key, 'sha1': fileHash(pgnPath)})
+    return table
+
+
+def loadMoveTables(pgnPaths: list, workers: int = None) -> pd.DataFrame:
+    """
+    This function returns the move tables of several PGN files as one table.
+    The GameIDs are counted through all files, like the games were in one PGN
+    """
+    tables = list()
+    games = 0
+    for pgnPath in pgnPaths:
+        table = loadMoveTable(pgnPath, workers=workers)
+        if len(table):
+            table = table.assign(GameID=table['GameID'] + games)
+            games = table['GameID'].max() + 1
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=MOVE_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+
+def iterGames(table: pd.DataFrame):
+    """
+    This function goes through the games of a move table.
+    It yields the headers of a game and its moves as dictionaries, missing values are None. The moves of a game without moves are an empty list
+    """
+    headerColumns = [c for c in table.columns if c not in MOVE_COLUMNS]
+    for _, moves in table.groupby('GameID', sort=False):
+        records = moves.astype(object).where(moves.notna(), None).to_dict('records')
+        headers = {c: records[0][c] for c in headerColumns if records[0][c] is not None}
+        yield headers, [record for record in records if record['Ply'] > 0]
+
+
+def evalScore(move: dict, mateScore: int = 10000) -> int:
+    """
+    This function returns the Lichess evaluation of a move from the table from white's perspective, like chess.engine.Score.score(mate_score=mateScore).
+    None if the move has no evaluation
+    """
+    if move['EvalMate'] is not None:
+        mate = move['EvalMate']
+        return mateScore - mate if mate > 0 else -mateScore - mate
+    return move['EvalCP']
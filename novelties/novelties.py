@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
 import evalDB
+import engines
 
 
 def searchPositions(pgn: str, script: str, db: str) -> tuple:
@@ -109,7 +110,7 @@ def isMistake(posBefore: str, posAfter: str, mistakeThreshold: int = 70) -> bool
     return -> bool:
         True if the move was a mistake, False otherwise
     """
-    sf = functions.configureEngine('stockfish', {'Threads': '10', 'Hash': '8192'})
+    sf = engines.getEngine('stockfish')
     time = 3
     # if evalDB.contains(posBefore):
     if False:
@@ -125,7 +126,6 @@ def isMistake(posBefore: str, posAfter: str, mistakeThreshold: int = 70) -> bool
         info = sf.analyse(chess.Board(posAfter), chess.engine.Limit(time=time))
         cpAfter = info['score'].white().score()
         # TODO: enter positions into eval DB
-    sf.quit()
     return abs(cpBefore-cpAfter) > mistakeThreshold
 
 
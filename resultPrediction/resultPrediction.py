@@ -8,6 +8,7 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import plotting_helper
+import headerIndex
 
 
 def extractResultData(pgnPath: str) -> pd.DataFrame:
@@ -16,16 +17,16 @@ def extractResultData(pgnPath: str) -> pd.DataFrame:
     for key in keys:
         data[key] = list()
 
-    with open(pgnPath, 'r') as pgn:
-        while game := chess.pgn.read_game(pgn):
-            for key in keys:
-                if key in game.headers.keys():
-                    if 'Elo' in key:
-                        data[key].append(int(game.headers[key]))
-                    else:
-                        data[key].append(game.headers[key])
+    # Only the headers are needed, they come from the header index of the PGN
+    for headers in headerIndex.readHeaders(pgnPath):
+        for key in keys:
+            if key in headers.keys():
+                if 'Elo' in key:
+                    data[key].append(int(headers[key]))
                 else:
-                    data[key].append(None)
+                    data[key].append(headers[key])
+            else:
+                data[key].append(None)
 
     df = pd.DataFrame(data)
     return df
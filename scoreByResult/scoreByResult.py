@@ -5,6 +5,7 @@ import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import plotting_helper
+import headerIndex
 
 
 def getGameData(pgnPath: str) -> pd.DataFrame:
@@ -12,34 +13,34 @@ def getGameData(pgnPath: str) -> pd.DataFrame:
     totalGames = 0
 
     data = {'White': list(), 'Black': list(), 'WhiteElo': list(), 'BlackElo': list(), 'Result': list(), 'Date': list(), 'TimeControl': list(), 'Event': list(), 'Round': list()}
-    with open(pgnPath, 'r', encoding='utf8') as pgn:
-        while game := chess.pgn.read_game(pgn):
-            event = game.headers['Event']
-            if "WhiteElo" not in game.headers.keys() or "BlackElo" not in game.headers.keys():
-                continue
-            if 'blitz' in event.lower() or 'armageddon' in event.lower() or 'FIDE World Bl' in event or 'ICC' in event or 'TB' in event or 'Carlsen-Ding Showdown' in event:
-                timeControl = 'blitz'
-            elif 'rapid' in event.lower() or 'cct' in event.lower() or 'speedchess' in event.lower() or 'gcl' in event.lower() or 'FTX Crypto Cup 2022' in event or 'Oslo Esports Cup 2022' in event or 'Global Chess League' in event or 'Cuadrangular UNAM 2012' in event or 'Uva Four player KO 2014' in event:
-                timeControl = 'rapid'
-            elif 'freestyle' in event.lower() or 'fischer random' in event.lower() or 'chess960' in event.lower() or 'Play Live Challenge 2016' in event:
-                continue
-            elif 'World Cup' in event and int(game.headers['Round'].split('.')[1]) > 4:
-                timeControl = 'blitz'
-            elif 'World Cup' in event and int(game.headers['Round'].split('.')[1]) > 2:
-                timeControl = 'rapid'
-            else:
-                totalGames += 1
-                timeControl = 'classical'
-
-            data['White'].append(game.headers['White'])
-            data['Black'].append(game.headers['Black'])
-            data['WhiteElo'].append(game.headers['WhiteElo'])
-            data['BlackElo'].append(game.headers['BlackElo'])
-            data['Result'].append(game.headers['Result'])
-            data['Date'].append(game.headers['Date'])
-            data['TimeControl'].append(timeControl)
-            data['Event'].append(event)
-            data['Round'].append(float(game.headers['Round']))
+    # Only the headers are needed, they come from the header index of the PGN
+    for headers in headerIndex.readHeaders(pgnPath):
+        event = headers['Event']
+        if "WhiteElo" not in headers.keys() or "BlackElo" not in headers.keys():
+            continue
+        if 'blitz' in event.lower() or 'armageddon' in event.lower() or 'FIDE World Bl' in event or 'ICC' in event or 'TB' in event or 'Carlsen-Ding Showdown' in event:
+            timeControl = 'blitz'
+        elif 'rapid' in event.lower() or 'cct' in event.lower() or 'speedchess' in event.lower() or 'gcl' in event.lower() or 'FTX Crypto Cup 2022' in event or 'Oslo Esports Cup 2022' in event or 'Global Chess League' in event or 'Cuadrangular UNAM 2012' in event or 'Uva Four player KO 2014' in event:
+            timeControl = 'rapid'
+        elif 'freestyle' in event.lower() or 'fischer random' in event.lower() or 'chess960' in event.lower() or 'Play Live Challenge 2016' in event:
+            continue
+        elif 'World Cup' in event and int(headers['Round'].split('.')[1]) > 4:
+            timeControl = 'blitz'
+        elif 'World Cup' in event and int(headers['Round'].split('.')[1]) > 2:
+            timeControl = 'rapid'
+        else:
+            totalGames += 1
+            timeControl = 'classical'
+
+        data['White'].append(headers['White'])
+        data['Black'].append(headers['Black'])
+        data['WhiteElo'].append(headers['WhiteElo'])
+        data['BlackElo'].append(headers['BlackElo'])
+        data['Result'].append(headers['Result'])
+        data['Date'].append(headers['Date'])
+        data['TimeControl'].append(timeControl)
+        data['Event'].append(event)
+        data['Round'].append(float(headers['Round']))
     df = pd.DataFrame(data)
     df = df.sort_values(by=['Date', 'Round'])
     return df
@@ -8,6 +8,7 @@ from os.path import isfile, join
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import functions
+import headerIndex
 import plotting_helper
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
@@ -64,58 +65,56 @@ def extractData(pgnPaths: list) -> pd.DataFrame:
     for pgnPath in pgnPaths:
         playerRatings = dict()
         year = pgnPath[-6:-4]
+        # The headers are read once from the header index and used for the seedings and the games
+        gameHeaders = headerIndex.readHeaders(pgnPath)
         
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                for color in ["White", "Black"]:
-                    if game.headers[color] not in playerRatings.keys():
-                        if f'{color}Elo' in game.headers.keys():
-                            elo = int(game.headers[f'{color}Elo'])
-                        else:
-                            elo = 0
-                        playerRatings[game.headers[color]] = elo
+        for header in gameHeaders:
+            for color in ["White", "Black"]:
+                if header[color] not in playerRatings.keys():
+                    if f'{color}Elo' in header.keys():
+                        elo = int(header[f'{color}Elo'])
+                    else:
+                        elo = 0
+                    playerRatings[header[color]] = elo
 
         seedings = list(dict(reversed(sorted(playerRatings.items(), key=lambda item: item[1]))).keys())
 
-        with open(pgnPath, 'r') as pgn:
-            while game := chess.pgn.read_game(pgn):
-                header = game.headers
-
-                playerNames = list()
-                for color in ["White", "Black"]:
-                    names = header[color].split(",")[0].split(" ")
-                    if len(names[0]) > 2 or len(names) == 1:
-                        playerNames.append(names[0])
-                    else:
-                        playerNames.append(f'{names[0]} {names[1]}')
-
-                playerNames = sorted(playerNames)
-                matchName = f'{playerNames[0]}-{playerNames[1]}, {year}'
-
-                data["Match"].append(matchName)
-                data["Round"].append(int(header["Round"].split(".")[0]))
-                data["GameNr"].append(int(header["Round"].split(".")[-1]))
-                data["White"].append(header["White"])
-                data["Black"].append(header["Black"])
-                if "Opening" in header.keys():
-                    data["Opening"].append(header["Opening"])
-                else:
-                    data["Opening"].append("No Opening")
-                if "WhiteElo" in header.keys():
-                    data["WhiteElo"].append(int(header["WhiteElo"]))
-                else:
-                    print(data["White"][-1])
-                    data["WhiteElo"].append(0)
-                if "BlackElo" in header.keys():
-                    data["BlackElo"].append(int(header["BlackElo"]))
+        for header in gameHeaders:
+            playerNames = list()
+            for color in ["White", "Black"]:
+                names = header[color].split(",")[0].split(" ")
+                if len(names[0]) > 2 or len(names) == 1:
+                    playerNames.append(names[0])
                 else:
-                    print(data["Black"][-1])
-                    data["BlackElo"].append(0)
+                    playerNames.append(f'{names[0]} {names[1]}')
+
+            playerNames = sorted(playerNames)
+            matchName = f'{playerNames[0]}-{playerNames[1]}, {year}'
+
+            data["Match"].append(matchName)
+            data["Round"].append(int(header["Round"].split(".")[0]))
+            data["GameNr"].append(int(header["Round"].split(".")[-1]))
+            data["White"].append(header["White"])
+            data["Black"].append(header["Black"])
+            if "Opening" in header.keys():
+                data["Opening"].append(header["Opening"])
+            else:
+                data["Opening"].append("No Opening")
+            if "WhiteElo" in header.keys():
+                data["WhiteElo"].append(int(header["WhiteElo"]))
+            else:
+                print(data["White"][-1])
+                data["WhiteElo"].append(0)
+            if "BlackElo" in header.keys():
+                data["BlackElo"].append(int(header["BlackElo"]))
+            else:
+                print(data["Black"][-1])
+                data["BlackElo"].append(0)
 
-                data["WhiteSeed"].append(seedings.index(header["White"])+1)
-                data["BlackSeed"].append(seedings.index(header["Black"])+1)
-                data["Result"].append(header["Result"])
-        
+            data["WhiteSeed"].append(seedings.index(header["White"])+1)
+            data["BlackSeed"].append(seedings.index(header["Black"])+1)
+            data["Result"].append(header["Result"])
+    
     return pd.DataFrame.from_dict(data)
 
 